@@ -1,12 +1,28 @@
 import os
 import re
-import json
 import logging
 import tempfile
 import base64
+import bisect
+import functools
 import binascii
+import hashlib
+import uuid
+import random
+from collections import OrderedDict
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import queue
+import threading
 import genanki
-from flask import Flask, request, redirect, url_for, flash, render_template_string, send_file
+import httpx
+import orjson
+import tiktoken
+from flask import Flask, Response, request, redirect, url_for, flash, render_template, send_file, stream_with_context
+from flask.json import JSONEncoder
+from flask_compress import Compress
+from jinja2 import FileSystemBytecodeCache
 from sacloze_plusplus import MODEL as SACLOZE_PLUSPLUS_MODEL
 
 #adding for new anki helper app
@@ -16,6 +32,13 @@ from flask import send_from_directory
 
 # Updated OpenAI API import and initialization.
 from openai import OpenAI  # Ensure you have the correct version installed
+from llm_cache import (
+    DEFAULT_CACHE_DIR,
+    DEFAULT_SEMANTIC_THRESHOLD,
+    ResponseCache,
+    SemanticCache,
+    make_cache_key,
+)
 from youtube_quiz import (
     YouTubeQuizError,
     generate_quiz_from_youtube_url,
@@ -25,6 +48,49 @@ from youtube_quiz import (
 app = Flask(__name__)
 app.secret_key = "your-secret-key"  # Replace with a secure secret
 
+# Compress HTML/JSON responses (brotli preferred, gzip fallback). The inlined
+# card JSON is full of repeated {{c1:: markers and shrinks dramatically.
+app.config["COMPRESS_ALGORITHM"] = ["br", "gzip"]
+app.config["COMPRESS_BR_LEVEL"] = 5
+app.config["COMPRESS_MIN_SIZE"] = 500
+# Streamed responses (the review page, batch results) are left alone: the
+# compressor would hold each small appendCards() fragment back until its
+# buffer fills, turning the progressive page back into a buffered one.
+app.config["COMPRESS_STREAMS"] = False
+Compress(app)
+
+# Keep JSON responses compact and in insertion order; sorting keys and
+# indenting only cost CPU and bytes on the wire.
+app.config["JSON_SORT_KEYS"] = False
+app.config["JSONIFY_PRETTYPRINT_REGULAR"] = False
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+class OrjsonEncoder(JSONEncoder):
+    """
+    Routes jsonify, dict responses and the tojson filter through orjson.
+    Calls that ask for indent or sort_keys, and values orjson can't handle
+    the way Flask does (datetimes become HTTP dates, not RFC 3339), fall
+    back to Flask's encoder.
+    """
+
+    def encode(self, o):
+        if self.indent is not None or self.sort_keys:
+            return super().encode(o)
+        try:
+            return orjson.dumps(o, option=ORJSON_OPTIONS | orjson.OPT_PASSTHROUGH_DATETIME).decode("utf-8")
+        except TypeError:
+            return super().encode(o)
+
+app.json_encoder = OrjsonEncoder
+
+# Templates live in templates/; keep their compiled bytecode on disk so new
+# workers skip recompiling them. Outside debug mode Flask already leaves
+# jinja_env.auto_reload off, so loaded templates are never re-stat'ed.
+JINJA_CACHE_DIR = os.path.join(tempfile.gettempdir(), "yt2anki-jinja")
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+
 #adding for anki helper app
 @app.route("/reviewer")
 def reviewer():
@@ -61,11 +127,34 @@ def youtube_quiz_prompt_template():
 #end adding for anki helper app
 
 # Set up logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=(os.environ.get("LOG_LEVEL") or os.environ.get("LOGLEVEL") or "INFO").upper())
 logger = logging.getLogger(__name__)
 
-# Initialize the OpenAI client
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# Initialize the OpenAI client on a shared, keep-alive HTTP/2 connection pool
+# so consecutive chunk requests reuse the same TLS connection. The pool is
+# sized above OPENAI_MAX_CONCURRENCY so embedding and reviewer calls, which
+# don't take a chunk slot, never wait on a connection.
+OPENAI_HTTP_POOL_SIZE = int(os.environ.get("OPENAI_HTTP_POOL_SIZE", "32"))
+_http_client = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(
+        max_connections=OPENAI_HTTP_POOL_SIZE,
+        max_keepalive_connections=OPENAI_HTTP_POOL_SIZE,
+        keepalive_expiry=60,
+    ),
+    timeout=60.0,
+)
+atexit.register(_http_client.close)
+# The SDK retries 408/409/429/5xx responses, timeouts and connection errors
+# with jittered exponential backoff, honouring Retry-After on rate limits.
+# Raise its default of 2 so a burst of parallel chunks rides out a 429
+# instead of dropping cards.
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", "5"))
+client = OpenAI(
+    api_key=os.environ.get("OPENAI_API_KEY"),
+    http_client=_http_client,
+    max_retries=OPENAI_MAX_RETRIES,
+)
 
 # Reviewer rewrite defaults. Environment overrides allow a rapid rollback or
 # controlled model evaluation without changing the endpoint contract.
@@ -453,38 +542,158 @@ def resolve_sacloze_model_id(payload):
 # Helper Functions
 # ----------------------------
 
+# Patterns used on every transcript and card, compiled once at import.
+_TIMESTAMP_RE = re.compile(r'\d{2}:\d{2}:\d{2}[.,]\d{3}')
+_WHITESPACE_RE = re.compile(r'\s+')
+_BR_TAG_RE = re.compile(r"<br\s*/?>", re.IGNORECASE)
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+_CLOZE_ANSWER_RE = re.compile(r"\{\{c\d+::(.*?)(?:::[^{}]*?)?\}\}", re.DOTALL)
+_CLOZE_MARKER_RE = re.compile(r"\{\{c\d+::")
+_WORD_RE = re.compile(r"[A-Za-z0-9]+(?:['’-][A-Za-z0-9]+)*")
+_MEDIA_FILENAME_RE = re.compile(r"[A-Za-z0-9._-]{1,180}")
+_SENTENCE_END_RE = re.compile(r"[.!?][\"')\]]*\s")
+
 def preprocess_transcript(text):
     """
     Remove common timestamp patterns (e.g. "00:00:00.160" or "00:00:00,160")
     and normalize whitespace.
     """
-    text_no_timestamps = re.sub(r'\d{2}:\d{2}:\d{2}[.,]\d{3}', '', text)
-    cleaned_text = re.sub(r'\s+', ' ', text_no_timestamps)
-    return cleaned_text.strip()
+    # str.split() collapses and trims whitespace in one C-level pass.
+    if ":" not in text:
+        return " ".join(text.split())
+    # Timestamps never contain whitespace, so they can be stripped per word,
+    # and only in words with a colon, without another pass over the text.
+    # Words that were nothing but a timestamp end up empty and are dropped.
+    strip_timestamps = _TIMESTAMP_RE.sub
+    words = [strip_timestamps('', word) if ":" in word else word for word in text.split()]
+    return " ".join(filter(None, words))
+
+CHUNK_BOUNDARY_WINDOW = 256
+# Smallest chunk chunk_text keeps on its own, and the smallest budgets the
+# form accepts: tinier chunks would mean hundreds of paid calls per transcript.
+CHUNK_MIN_SIZE = 100
+MIN_CHUNK_TOKENS = 100
+CHUNK_TOKEN_ENCODING = "o200k_base"
+
+@functools.lru_cache(maxsize=None)
+def _chunk_token_encoding():
+    # Loaded on first use: the BPE ranks may need downloading.
+    return tiktoken.get_encoding(CHUNK_TOKEN_ENCODING)
+
+def chars_for_token_budget(text, max_tokens):
+    """
+    Converts a per-chunk token budget into a character budget for chunk_text,
+    using this transcript's own characters-per-token ratio.
+    """
+    token_count = len(_chunk_token_encoding().encode_ordinary(text))
+    if not token_count:
+        return max(1, max_tokens)
+    return max(1, len(text) * max_tokens // token_count)
 
-def chunk_text(text, max_size, min_size=100):
+def chunk_text(text, max_size, min_size=CHUNK_MIN_SIZE):
     """
-    Splits text into chunks of up to max_size characters.
+    Splits text into chunks of up to max_size characters, preferring to end
+    a chunk at a sentence end in its second half and otherwise at a space.
     If a chunk is shorter than min_size and there is a previous chunk,
     it is merged with the previous chunk.
     """
-    chunks = []
+    # Sentence ends are found in one pass up front; each boundary is then a
+    # binary search instead of a scan.
+    sentence_ends = [m.end() - 1 for m in _SENTENCE_END_RE.finditer(text)]
+    bounds = []
+    length = len(text)
     start = 0
-    while start < len(text):
+    while start < length:
         end = start + max_size
-        if end < len(text):
-            last_space = text.rfind(" ", start, end)
-            if last_space != -1:
-                end = last_space
-        chunk = text[start:end]
-        if chunks and len(chunk) < min_size:
-            chunks[-1] += chunk
+        if end < length:
+            i = bisect.bisect_right(sentence_ends, end) - 1
+            if i >= 0 and sentence_ends[i] > start and sentence_ends[i] >= start + max_size // 2:
+                end = sentence_ends[i]
+            else:
+                # Only look back a word's length for a space, so each boundary
+                # costs O(1) and the whole split is a single O(N) pass.
+                last_space = text.rfind(" ", max(start + 1, end - CHUNK_BOUNDARY_WINDOW), end)
+                if last_space != -1:
+                    end = last_space
+        if bounds and end - start < min_size:
+            bounds[-1] = (bounds[-1][0], end)
         else:
-            chunks.append(chunk)
+            bounds.append((start, end))
         start = end
+    # Slice once per chunk; merged short tails never get concatenated.
+    chunks = [text[s:e] for s, e in bounds]
     logger.debug("Total number of chunks after splitting: %d", len(chunks))
     return chunks
 
+def drop_duplicate_chunks(chunks):
+    """
+    Drops chunks that repeat an earlier one (intros, sponsor reads, recaps),
+    comparing case-insensitively, so each distinct chunk is only sent once.
+    """
+    seen = set()
+    unique = []
+    for chunk in chunks:
+        digest = hashlib.blake2b(chunk.lower().encode("utf-8"), digest_size=16).digest()
+        if digest not in seen:
+            seen.add(digest)
+            unique.append(chunk)
+    if len(unique) < len(chunks):
+        logger.info("Skipped %d duplicate chunks", len(chunks) - len(unique))
+    return unique
+
+# Recently chunked transcripts, so generating cards and then a game from the
+# same transcript only cleans and splits it once.
+_CHUNKED_TRANSCRIPTS = OrderedDict()
+_CHUNKED_TRANSCRIPTS_MAX = 16
+_chunked_transcripts_lock = threading.Lock()
+
+def clean_and_chunk(transcript, max_chunk_size):
+    """
+    Preprocesses a transcript and splits it into distinct chunks, reusing the
+    result for a transcript/size pair seen recently.
+    """
+    key = (hashlib.sha256(transcript.encode("utf-8")).hexdigest(), max_chunk_size)
+    with _chunked_transcripts_lock:
+        chunks = _CHUNKED_TRANSCRIPTS.get(key)
+        if chunks is not None:
+            _CHUNKED_TRANSCRIPTS.move_to_end(key)
+            return list(chunks)
+    cleaned_transcript = preprocess_transcript(transcript)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Cleaned transcript (first 200 chars): %s", cleaned_transcript[:200])
+    chunks = tuple(drop_duplicate_chunks(chunk_text(cleaned_transcript, max_chunk_size)))
+    with _chunked_transcripts_lock:
+        _CHUNKED_TRANSCRIPTS[key] = chunks
+        _CHUNKED_TRANSCRIPTS.move_to_end(key)
+        while len(_CHUNKED_TRANSCRIPTS) > _CHUNKED_TRANSCRIPTS_MAX:
+            _CHUNKED_TRANSCRIPTS.popitem(last=False)
+    return list(chunks)
+
+# One alternation covers attempted cloze tokens like {c1::...} or
+# {{{c2::...}}} plus stray over-openers/over-closers elsewhere. The body never
+# crosses a NUL so several cards can be fixed in one joined pass.
+_CLOZE_FIX_RE = re.compile(r"\{+c(\d+)::([^\x00]*?)\}+|\{{3,}c|\}{3,}")
+_CLOZE_OVER_OPEN_RE = re.compile(r"\{{3,}c")
+# A lone brace or a run of three or more; text without one is already in
+# the shape the schema asks for and _fix_cloze_text would return unchanged.
+_CLOZE_BRACE_ANOMALY_RE = re.compile(r"(?<!\{)\{(?!\{)|\{{3}|(?<!\})\}(?!\})|\}{3}")
+_CARD_SEPARATOR = "\x00"
+
+def _fix_cloze_match(match):
+    number = match.group(1)
+    if number is None:
+        return "{{c" if match.group(0).endswith("c") else "}}"
+    body = match.group(2)
+    if "{{{" in body:
+        # A body can swallow the over-opener of a malformed nested cloze.
+        body = _CLOZE_OVER_OPEN_RE.sub("{{c", body)
+    return "{{c" + number + "::" + body + "}}"
+
+def _fix_cloze_text(text):
+    if not _CLOZE_BRACE_ANOMALY_RE.search(text):
+        return text
+    return _CLOZE_FIX_RE.sub(_fix_cloze_match, text)
+
 def fix_cloze_formatting(card):
     """
     Normalize cloze deletions so they always use exactly two curly braces
@@ -492,18 +701,26 @@ def fix_cloze_formatting(card):
     """
     if not isinstance(card, str) or "::" not in card:
         return card
+    return _fix_cloze_text(card)
 
-    # Normalize attempted cloze tokens like {c1::...}, {{{c2::...}}}, etc.
-    card = re.sub(
-        r"\{+c(\d+)::([\s\S]*?)\}+",
-        lambda m: "{{{{c{}::{}}}}}".format(m.group(1), m.group(2)),
-        card,
-    )
-
-    # Safety pass: collapse over-openers and over-closers around valid clozes.
-    card = re.sub(r"\{{3,}c", "{{c", card)
-    card = re.sub(r"\}{3,}", "}}", card)
-    return card
+def fix_cloze_formatting_all(cards):
+    """
+    Applies fix_cloze_formatting to a list of cards, running each regex once
+    over the NUL-joined cards instead of once per card.
+    """
+    positions = [
+        i for i, card in enumerate(cards)
+        if isinstance(card, str) and "::" in card
+    ]
+    if not positions:
+        return list(cards)
+    targets = [cards[i] for i in positions]
+    if any(_CARD_SEPARATOR in card for card in targets):
+        return [fix_cloze_formatting(card) for card in cards]
+    fixed = list(cards)
+    for i, card in zip(positions, _fix_cloze_text(_CARD_SEPARATOR.join(targets)).split(_CARD_SEPARATOR)):
+        fixed[i] = card
+    return fixed
 
 
 def normalize_card_text_for_comparison(card):
@@ -512,21 +729,205 @@ def normalize_card_text_for_comparison(card):
         return ""
 
     normalized = fix_cloze_formatting(card)
-    normalized = re.sub(r"<br\s*/?>", "<br>", normalized, flags=re.IGNORECASE)
-    normalized = re.sub(r"\s+", " ", normalized).strip()
+    normalized = _BR_TAG_RE.sub("<br>", normalized)
+    normalized = _WHITESPACE_RE.sub(" ", normalized).strip()
     return normalized.lower()
 
-def get_anki_cards_for_chunk(transcript_chunk, user_preferences="", model="gpt-4o"):
+def _loads_streamed_item(item_text):
+    """Parses one streamed array element; returns [] if it is blank or malformed."""
+    item_text = item_text.strip()
+    if not item_text:
+        return []
+    try:
+        return [orjson.loads(item_text)]
+    except ValueError as parse_err:
+        logger.error("Skipping unparsable streamed item: %s", parse_err)
+        return []
+
+def iter_json_array_items(fragments, closed=None):
     """
-    Calls the OpenAI API with a transcript chunk and returns a list of Anki cloze deletion flashcards.
+    Incrementally scans streamed text fragments and yields each element of the
+    first JSON array as soon as the element is complete. Text before the array
+    (e.g. a markdown fence) is ignored. When `closed` is given, True is
+    appended to it once the array's closing bracket arrives, so callers can
+    tell a complete array from a truncated one.
     """
-    user_instr = ""
-    if user_preferences.strip():
-        user_instr = f'\nUser Request: {user_preferences.strip()}\nIf no content relevant to the user request is found in this chunk, output a dummy card in the format: "User request not found in {{c1::this chunk}}."'
-    
-    prompt = f"""
-You are an expert at creating study flashcards in Anki using cloze deletion.
-Given the transcript below, generate a list of flashcards.
+    buffer = ""
+    scan_from = 0
+    item_start = 0
+    depth = 0
+    in_string = False
+    escaped = False
+    for fragment in fragments:
+        if not fragment:
+            continue
+        buffer += fragment
+        for i in range(scan_from, len(buffer)):
+            ch = buffer[i]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif depth == 0:
+                if ch == "[":
+                    depth = 1
+                    item_start = i + 1
+            elif ch == '"':
+                in_string = True
+            elif ch in "[{":
+                depth += 1
+            elif ch in "]}":
+                depth -= 1
+                if depth == 0:
+                    yield from _loads_streamed_item(buffer[item_start:i])
+                    if closed is not None:
+                        closed.append(True)
+                    return
+            elif ch == "," and depth == 1:
+                yield from _loads_streamed_item(buffer[item_start:i])
+                item_start = i + 1
+        # Drop text that has already been consumed so the buffer stays small.
+        if depth == 0:
+            buffer = ""
+            scan_from = 0
+        else:
+            scan_from = len(buffer) - item_start
+            buffer = buffer[item_start:]
+            item_start = 0
+
+def stream_chat_fragments(system_prompt, prompt, model, max_tokens, response_format, parts=None, temperature=0.7):
+    """
+    Starts a streamed chat completion and yields its text fragments as they
+    arrive. When `parts` is given, every fragment is also appended to it.
+    """
+    stream = client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=temperature,
+        max_tokens=max_tokens,
+        response_format=response_format,
+        timeout=60,
+        stream=True
+    )
+    try:
+        for event in stream:
+            if not event.choices:
+                continue
+            content = event.choices[0].delta.content
+            if content:
+                if parts is not None:
+                    parts.append(content)
+                yield content
+    finally:
+        # Parsing may stop at the closing bracket; release the connection.
+        stream.close()
+
+def collect_json_array_completion(system_prompt, prompt, model, max_tokens, response_format, temperature=0.7, closed=None):
+    """
+    Streams a completion and parses the elements of its JSON array while the
+    tokens are still arriving (the first array in the response, i.e. the one
+    wrapped by the structured-output object). Returns (items, result_text);
+    items is empty when no element was parsed, so callers can check result_text.
+    `closed` is passed on to iter_json_array_items.
+    """
+    parts = []
+    with openai_slots:
+        fragments = stream_chat_fragments(system_prompt, prompt, model, max_tokens, response_format, parts, temperature)
+        try:
+            items = list(iter_json_array_items(fragments, closed))
+        finally:
+            fragments.close()
+    return items, "".join(parts).strip()
+
+# Structured outputs make an unparsable response rare (e.g. one truncated at
+# max_tokens); such a chunk gets one deterministic retry before it is dropped.
+CHUNK_ATTEMPT_TEMPERATURES = (0.7, 0.0)
+
+DEFAULT_MODEL = "gpt-4o-mini"
+DENSE_CHUNK_MODEL = "gpt-4o"
+# Chunks scoring above this (capitalised-word ratio + distinct-word ratio)
+# read as dense, name-heavy material that benefits from the larger model.
+DENSE_CHUNK_THRESHOLD = 0.65
+
+def chunk_complexity(transcript_chunk):
+    """Cheap density score: share of capitalised words plus share of distinct words."""
+    words = _WORD_RE.findall(transcript_chunk)
+    if not words:
+        return 0.0
+    capitalized = sum(1 for word in words if word[0].isupper())
+    distinct = len({word.lower() for word in words})
+    return (capitalized + distinct) / len(words)
+
+def resolve_model(model, transcript_chunk):
+    """Maps model="auto" to a concrete model for this chunk."""
+    if model != "auto":
+        return model
+    if chunk_complexity(transcript_chunk) > DENSE_CHUNK_THRESHOLD:
+        return DENSE_CHUNK_MODEL
+    return DEFAULT_MODEL
+
+# Structured Outputs: the API guarantees JSON matching these schemas, and the
+# pattern forces at least one properly double-braced cloze per card. Strict
+# schemas need an object at the root, so the lists are wrapped.
+ANKI_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "anki_cards",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "cards": {
+                    "type": "array",
+                    "items": {"type": "string", "pattern": "\\{\\{c[0-9]+::[^{}]+\\}\\}"},
+                },
+            },
+            "required": ["cards"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+INTERACTIVE_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "interactive_questions",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "questions": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "question": {"type": "string"},
+                            "options": {"type": "array", "items": {"type": "string"}},
+                            "correctAnswer": {"type": "string"},
+                            "explanation": {"type": "string"},
+                        },
+                        "required": ["question", "options", "correctAnswer", "explanation"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["questions"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+# Static instructions go in the system message so every chunk request shares
+# an identical prefix (eligible for OpenAI's automatic prompt caching); only
+# the user's preferences and the transcript vary per call.
+ANKI_SYSTEM_PROMPT = """You are an expert at creating study flashcards in Anki using cloze deletion.
+Given the transcript in the user message, generate a list of flashcards.
 Each flashcard should be a complete, self-contained sentence (or sentence fragment) containing one or more cloze deletions.
 Each cloze deletion must be formatted exactly as:
   {{c1::hidden text}}
@@ -571,50 +972,224 @@ Follow these formatting instructions exactly:
    • Focus on college-level or expert-level knowledge.
    • Use HTML formatting for better display.
    • If Anki cards are provided by the user in Cloze deletion format, go ahead and use them verbatim in the format given rather than making changes.
-In addition, you must make sure to follow the following instructions:
-{user_instr}
-Ensure you output ONLY a valid JSON array of strings, with no additional commentary or markdown.
-    
-Transcript:
-\"\"\"{transcript_chunk}\"\"\" 
+Output a JSON object whose "cards" array holds the flashcards as strings.
 """
+
+# The transcript is wrapped in XML-style tags rather than triple quotes, which
+# transcripts can contain; a literal closing tag inside one is neutralised.
+TRANSCRIPT_OPEN_TAG = "<transcript>\n"
+TRANSCRIPT_CLOSE_TAG = "\n</transcript>\n"
+
+def escape_transcript_chunk(transcript_chunk):
+    if "</transcript" not in transcript_chunk:
+        return transcript_chunk
+    return transcript_chunk.replace("</transcript", "<\\/transcript")
+
+@functools.lru_cache(maxsize=64)
+def anki_prompt_builder(user_preferences=""):
+    """
+    Partially evaluates the cloze-card user message for one preferences
+    string; every chunk of a request (and repeat requests) reuses the result.
+    Returns a function mapping a transcript chunk to its user message.
+    """
+    user_instr = ""
+    if user_preferences.strip():
+        user_instr = f'In addition, you must make sure to follow the following instructions:\nUser Request: {user_preferences.strip()}\nIf no content relevant to the user request is found in this chunk, output a dummy card in the format: "User request not found in {{{{c1::this chunk}}}}."\n\n'
+    prefix = user_instr + TRANSCRIPT_OPEN_TAG
+
+    def build(transcript_chunk):
+        return prefix + escape_transcript_chunk(transcript_chunk) + TRANSCRIPT_CLOSE_TAG
+    return build
+
+def build_anki_prompt(transcript_chunk, user_preferences=""):
+    """Builds the per-chunk user message for cloze-card generation."""
+    return anki_prompt_builder(user_preferences)(transcript_chunk)
+
+# Parsed chunk results keyed by (kind, model, preferences, chunk); identical
+# resubmissions skip the API entirely. Entries expire after LLM_CACHE_TTL
+# seconds (30 days by default) and are then swept from disk.
+chunk_cache = ResponseCache(
+    maxsize=int(os.environ.get("LLM_CACHE_SIZE", "1024")),
+    directory=os.environ.get("LLM_CACHE_DIR", DEFAULT_CACHE_DIR),
+    ttl=int(os.environ.get("LLM_CACHE_TTL", str(30 * 24 * 3600))),
+)
+# Near-duplicate chunks (re-uploads, overlapping videos) are matched by
+# embedding similarity; an embedding costs far less than the chat call.
+EMBEDDING_MODEL = "text-embedding-3-small"
+semantic_cache = SemanticCache(
+    directory=os.path.join(os.environ.get("LLM_CACHE_DIR", DEFAULT_CACHE_DIR), "semantic"),
+)
+
+def embed_text(text):
+    response = client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+    return response.data[0].embedding
+
+def lookup_chunk_cache(kind, model, user_preferences, transcript_chunk, use_cache=True, semantic_threshold=None):
+    """
+    Looks a chunk up in the exact cache, then (when a threshold is given) in
+    the semantic cache. Returns (cached_result_or_None, remember) where
+    remember(result) stores a freshly generated result in both caches.
+    """
+    key = make_cache_key(kind, model, user_preferences, transcript_chunk)
+    namespace = make_cache_key(kind, model, user_preferences)
+    embedding = None
+    if use_cache:
+        cached = chunk_cache.get(key)
+        if cached is not None:
+            logger.debug("Cache hit for %s chunk", kind)
+            return cached, None
+        if semantic_threshold:
+            try:
+                embedding = embed_text(transcript_chunk)
+                cached = semantic_cache.lookup(namespace, embedding, semantic_threshold)
+            except Exception as e:
+                logger.error("Semantic cache lookup failed: %s", e)
+                cached = None
+            if cached is not None:
+                logger.debug("Semantic cache hit for %s chunk", kind)
+                chunk_cache.set(key, cached)
+                return cached, None
+
+    def remember(result):
+        if not result:
+            return
+        chunk_cache.set(key, result)
+        if embedding is not None:
+            semantic_cache.add(namespace, embedding, result)
+
+    return None, remember
+
+def deck_cache_key(kind, transcript, user_preferences, model, max_chunk_size):
+    """
+    Cache key for a whole generated set, so an identical resubmission skips
+    chunking and the per-chunk lookups altogether.
+    """
+    return make_cache_key(kind + "-deck", model, user_preferences, str(max_chunk_size), transcript)
+
+# Chunk requests are I/O-bound, so they are fanned out over a thread pool.
+# The per-request pool size can be chosen in the advanced options, up to
+# MAX_CHUNK_WORKERS_LIMIT.
+MAX_CHUNK_WORKERS = 8
+MAX_CHUNK_WORKERS_LIMIT = 16
+
+# Caps in-flight chunk completions across all requests in this process, so
+# concurrent users (each with its own pool) stay within the API rate limits.
+OPENAI_MAX_CONCURRENCY = int(os.environ.get("OPENAI_MAX_CONCURRENCY", "16"))
+openai_slots = threading.BoundedSemaphore(OPENAI_MAX_CONCURRENCY)
+
+# Flashed messages live in the session cookie, so quoted API responses are
+# cut to an excerpt; the full text is only logged at DEBUG.
+ERROR_EXCERPT_CHARS = 300
+
+def response_excerpt(result_text):
+    if len(result_text) <= ERROR_EXCERPT_CHARS:
+        return result_text
+    return result_text[:ERROR_EXCERPT_CHARS] + "…"
+
+def report_chunk_error(message, errors=None):
+    """
+    Flashes a per-chunk error, or collects it when running outside the request
+    thread (flash() needs the request context).
+    """
+    if errors is None:
+        flash(message)
+    else:
+        errors.append(message)
+
+def map_chunks_in_parallel(func, chunks, max_workers=MAX_CHUNK_WORKERS):
+    """
+    Runs func(chunk) for every chunk on a thread pool and returns the results
+    in chunk order.
+    """
+    if len(chunks) <= 1 or max_workers <= 1:
+        return [func(chunk) for chunk in chunks]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+        return list(executor.map(func, chunks))
+
+def _dumps(obj):
+    """Serializes obj to a compact JSON str using orjson."""
+    return orjson.dumps(obj, option=ORJSON_OPTIONS).decode("utf-8")
+
+def parse_json_array_response(result_text, key, label="chunk"):
+    """
+    Parses a structured-output response of the form {key: [...]} and returns
+    the list, or None when the response is not valid JSON of that shape.
+    """
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=4000,
-            timeout=60
-        )
-        result_text = response.choices[0].message.content.strip()
-        logger.debug("Raw API response for chunk: %s", result_text)
+        parsed = orjson.loads(result_text)
+    except ValueError as parse_err:
+        logger.error("JSON parsing error for %s: %s", label, parse_err)
+        return None
+    if isinstance(parsed, dict):
+        parsed = parsed.get(key)
+    if isinstance(parsed, list):
+        return parsed
+    logger.error("Unexpected JSON shape for %s", label)
+    return None
+
+def parse_anki_cards_response(result_text):
+    """
+    Parses a model response into a list of formatted cloze cards.
+    Returns None when no JSON array can be recovered from it.
+    """
+    cards = parse_json_array_response(result_text, "cards")
+    if cards is None:
+        return None
+    return fix_cloze_formatting_all(cards)
+
+def stream_anki_cards_for_chunk(transcript_chunk, user_preferences="", model=DEFAULT_MODEL, errors=None, use_cache=True, semantic_threshold=None):
+    """
+    Streams the completion for a transcript chunk and yields each Anki card as
+    soon as it has fully arrived, instead of waiting for the whole response.
+    A chunk that fails before its first card is retried at the next of
+    CHUNK_ATTEMPT_TEMPERATURES; problems are reported through `errors`.
+    """
+    model = resolve_model(model, transcript_chunk)
+    cached, remember = lookup_chunk_cache("anki", model, user_preferences, transcript_chunk, use_cache, semantic_threshold)
+    if cached is not None:
+        yield from cached
+        return
+    prompt = build_anki_prompt(transcript_chunk, user_preferences)
+    for temperature in CHUNK_ATTEMPT_TEMPERATURES:
+        cards = []
+        closed = []
         try:
-            cards = json.loads(result_text)
-            if isinstance(cards, list):
-                cards = [fix_cloze_formatting(card) for card in cards]
-                return cards
-        except Exception as parse_err:
-            logger.error("JSON parsing error for chunk: %s", parse_err)
-            start_idx = result_text.find('[')
-            end_idx = result_text.rfind(']')
-            if start_idx != -1 and end_idx != -1:
-                json_str = result_text[start_idx:end_idx+1]
+            # The slot is held while the response streams in, since the
+            # connection stays busy until the last event arrives.
+            with openai_slots:
+                fragments = stream_chat_fragments(
+                    ANKI_SYSTEM_PROMPT, prompt, model, max_tokens=4000, response_format=ANKI_RESPONSE_FORMAT,
+                    temperature=temperature,
+                )
                 try:
-                    cards = json.loads(json_str)
-                    if isinstance(cards, list):
-                        cards = [fix_cloze_formatting(card) for card in cards]
-                        return cards
-                except Exception as e:
-                    logger.error("Fallback JSON parsing failed for chunk: %s", e)
-        flash("Failed to generate Anki cards for a chunk. API response: " + result_text)
-        return []
-    except Exception as e:
-        logger.error("OpenAI API error for chunk: %s", e)
-        flash("OpenAI API error for a chunk: " + str(e))
-        return []
+                    for card in iter_json_array_items(fragments, closed):
+                        if isinstance(card, str):
+                            card = fix_cloze_formatting(card)
+                            cards.append(card)
+                            yield card
+                finally:
+                    # Release the connection before the slot, even when
+                    # parsing stops at the closing bracket.
+                    fragments.close()
+        except Exception as e:
+            logger.error("OpenAI API error while streaming chunk: %s", e)
+            message = "OpenAI API error for a chunk: " + str(e)
+            if cards:
+                # Cards already on the page can't be taken back, so no retry.
+                report_chunk_error(message, errors)
+                return
+            continue
+        if closed:
+            remember(cards)
+            return
+        if cards:
+            # Cut off (e.g. by the token limit) after some cards: keep them,
+            # but don't cache an incomplete chunk.
+            report_chunk_error("The response for a chunk was cut off; some of its cards may be missing.", errors)
+            return
+        logger.warning("Unparsable Anki response at temperature %s", temperature)
+        message = "Failed to generate Anki cards for a chunk."
+    report_chunk_error(message, errors)
 
 
 BRIEF_FORBIDDEN_AUDIO_SYMBOLS = (":", ";", "→", "←", "↔", "•", "|", "/", "\\", "*", "#", "=", "—", "–")
@@ -622,19 +1197,14 @@ BRIEF_FORBIDDEN_AUDIO_SYMBOLS = (":", ";", "→", "←", "↔", "•", "|", "/",
 
 def card_visible_text(card_text):
     """Return the spoken portion of a card without cloze or HTML markup."""
-    text = re.sub(
-        r"\{\{c\d+::(.*?)(?:::[^{}]*?)?\}\}",
-        r"\1",
-        card_text or "",
-        flags=re.DOTALL,
-    )
-    text = re.sub(r"<br\s*/?>", " ", text, flags=re.IGNORECASE)
-    text = re.sub(r"<[^>]+>", " ", text)
-    return re.sub(r"\s+", " ", text).strip()
+    text = _CLOZE_ANSWER_RE.sub(r"\1", card_text or "")
+    text = _BR_TAG_RE.sub(" ", text)
+    text = _HTML_TAG_RE.sub(" ", text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
 
 
 def card_word_count(card_text):
-    return len(re.findall(r"[A-Za-z0-9]+(?:['’-][A-Za-z0-9]+)*", card_visible_text(card_text)))
+    return len(_WORD_RE.findall(card_visible_text(card_text)))
 
 
 def brief_rewrite_issues(original_text, suggestion):
@@ -644,9 +1214,7 @@ def brief_rewrite_issues(original_text, suggestion):
     if not suggestion:
         return ["The rewrite was empty."]
 
-    if re.search(r"\{\{c\d+::", original_text) and not re.search(
-        r"\{\{c\d+::", suggestion
-    ):
+    if _CLOZE_MARKER_RE.search(original_text) and not _CLOZE_MARKER_RE.search(suggestion):
         issues.append("The rewrite removed every cloze deletion.")
 
     visible = card_visible_text(suggestion)
@@ -1039,10 +1607,10 @@ Original card text:
 
     raw = (response.choices[0].message.content or "").strip()
     try:
-        cards = json.loads(raw)
+        cards = orjson.loads(raw)
         if not isinstance(cards, list):
             raise ValueError("Response was not a list")
-        cards = [fix_cloze_formatting(c) for c in cards if isinstance(c, str) and c.strip()]
+        cards = fix_cloze_formatting_all([c for c in cards if isinstance(c, str) and c.strip()])
         if len(cards) != num_cards:
             raise ValueError("Unexpected number of cards returned")
         return cards
@@ -1112,14 +1680,14 @@ Original cards:
 
     raw = (response.choices[0].message.content or "").strip()
     try:
-        rewritten_cards = json.loads(raw)
+        rewritten_cards = orjson.loads(raw)
         if not isinstance(rewritten_cards, list):
             raise ValueError("Response was not a list")
-        rewritten_cards = [
-            fix_cloze_formatting(card)
+        rewritten_cards = fix_cloze_formatting_all([
+            card
             for card in rewritten_cards
             if isinstance(card, str) and card.strip()
-        ]
+        ])
         if len(rewritten_cards) != len(cleaned_cards):
             raise ValueError("Unexpected number of cards returned")
         return rewritten_cards
@@ -1127,1489 +1695,291 @@ Original cards:
         logger.error("Failed to parse uniform-card response: %s", exc)
         raise ValueError("Invalid response while making cards uniform")
 
-def get_all_anki_cards(transcript, user_preferences="", max_chunk_size=4000, model="gpt-4o"):
+def iter_all_anki_cards(transcript, user_preferences="", max_chunk_size=4000, model=DEFAULT_MODEL, use_cache=True, semantic_threshold=None, max_workers=MAX_CHUNK_WORKERS, errors=None):
     """
-    Preprocesses the transcript, splits it into chunks, and processes each chunk.
-    Returns a combined list of all flashcards.
+    Preprocesses the transcript, splits it into chunks, and yields each
+    flashcard as soon as it is parsed so the review page can show the first
+    card early. Per-chunk problems are appended to `errors` once the stream
+    ends (flash() can't reach the user after the headers are sent).
     """
-    cleaned_transcript = preprocess_transcript(transcript)
-    logger.debug("Cleaned transcript (first 200 chars): %s", cleaned_transcript[:200])
-    chunks = chunk_text(cleaned_transcript, max_chunk_size)
+    key = deck_cache_key("anki", transcript, user_preferences, model, max_chunk_size)
+    if use_cache:
+        cached = chunk_cache.get(key)
+        if cached is not None:
+            logger.debug("Cache hit for the whole card set")
+            yield from cached
+            return
+    chunk_errors = []
     all_cards = []
-    for i, chunk in enumerate(chunks):
-        logger.debug("Processing chunk %d/%d", i+1, len(chunks))
-        cards = get_anki_cards_for_chunk(chunk, user_preferences, model=model)
-        logger.debug("Chunk %d produced %d cards.", i+1, len(cards))
-        all_cards.extend(cards)
+    for card in _iter_chunked_anki_cards(transcript, user_preferences, max_chunk_size, model, use_cache, semantic_threshold, max_workers, chunk_errors):
+        all_cards.append(card)
+        yield card
+    if errors is not None:
+        errors.extend(chunk_errors)
+    # Partial sets (some chunk failed) are not cached, so a retry can fill them in.
+    if all_cards and not chunk_errors:
+        chunk_cache.set(key, all_cards)
     logger.debug("Total flashcards generated: %d", len(all_cards))
-    return all_cards
+
+def _iter_chunked_anki_cards(transcript, user_preferences, max_chunk_size, model, use_cache, semantic_threshold, max_workers, errors):
+    chunks = clean_and_chunk(transcript, max_chunk_size)
+    logger.debug("Processing %d chunks", len(chunks))
+    if not chunks:
+        return
+
+    # Chunks stream on worker threads (concurrently, up to max_workers);
+    # cards are still yielded in chunk order, with later chunks buffering in
+    # their queues until it is their turn. Even a single chunk goes through
+    # a worker, so a slow client never holds an OpenAI slot while the
+    # response is written.
+    done = object()
+    queues = [queue.Queue() for _ in chunks]
+
+    def pump(chunk, out):
+        try:
+            for card in stream_anki_cards_for_chunk(chunk, user_preferences, model=model, errors=errors, use_cache=use_cache, semantic_threshold=semantic_threshold):
+                out.put(card)
+        finally:
+            out.put(done)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks))))
+    try:
+        for chunk, out in zip(chunks, queues):
+            executor.submit(pump, chunk, out)
+        for i, out in enumerate(queues):
+            logger.debug("Streaming chunk %d/%d", i+1, len(chunks))
+            for card in iter(out.get, done):
+                yield card
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
 # ----------------------------
-# New Functions for Interactive Mode
+# Batch API Mode
 # ----------------------------
+# Non-interactive jobs can go through the Batch API instead: roughly half the
+# token cost, at the price of results arriving minutes to hours later.
+BATCH_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
 
-def get_interactive_questions_for_chunk(transcript_chunk, user_preferences="", model="gpt-4o"):
+def submit_batch(chunks, system_prompt, prompt_builder, model, response_format, max_tokens=4000):
     """
-    Calls the OpenAI API with a transcript chunk and returns a list of interactive multiple-choice questions.
-    Each question is a JSON object with keys: "question", "options", "correctAnswer" (and optionally "explanation").
+    Uploads one chat completion request per chunk as a JSONL batch file and
+    starts a batch job. Returns the created batch object.
     """
-    user_instr = ""
-    if user_preferences.strip():
-        user_instr = f'\nUser Request: {user_preferences.strip()}\nIf no content relevant to the user request is found in this chunk, output a dummy question in the required JSON format.'
-    
-    prompt = f"""
+    lines = []
+    for i, chunk in enumerate(chunks):
+        lines.append(_dumps({
+            "custom_id": f"c{i}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": resolve_model(model, chunk),
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt_builder(chunk)}
+                ],
+                "temperature": 0.7,
+                "max_tokens": max_tokens,
+                "response_format": response_format,
+            },
+        }))
+    batch_file = client.files.create(
+        file=("chunks.jsonl", "\n".join(lines).encode("utf-8"), "application/jsonl"),
+        purpose="batch",
+    )
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    logger.info("Submitted batch %s with %d chunks", batch.id, len(chunks))
+    return batch
+
+def get_batch_results(batch):
+    """
+    Downloads a completed batch's output and returns the response text of each
+    request in chunk order (None for requests that failed).
+    """
+    texts = {}
+    if batch.output_file_id:
+        output = client.files.content(batch.output_file_id).text
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            record = orjson.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") != 200:
+                logger.error("Batch request %s failed: %s", record.get("custom_id"), record.get("error"))
+                continue
+            texts[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"].strip()
+    total = batch.request_counts.total if batch.request_counts else len(texts)
+    return [texts.get(f"c{i}") for i in range(total)]
+
+def submit_anki_batch(transcript, user_preferences="", max_chunk_size=4000, model=DEFAULT_MODEL):
+    """
+    Batch API counterpart of iter_all_anki_cards: submits every chunk at once
+    and returns the batch object to poll.
+    """
+    chunks = clean_and_chunk(transcript, max_chunk_size)
+    return submit_batch(
+        chunks, ANKI_SYSTEM_PROMPT, anki_prompt_builder(user_preferences), model, ANKI_RESPONSE_FORMAT
+    )
+
+# ----------------------------
+# New Functions for Interactive Mode
+# ----------------------------
+
+INTERACTIVE_SYSTEM_PROMPT = """
 You are an expert at creating interactive multiple-choice questions for educational purposes.
-Given the transcript below, generate a list of interactive multiple-choice questions.
+Given the transcript in the user message, generate a list of interactive multiple-choice questions.
 Each question must be a JSON object with the following keys:
   "question": a string containing the question text.
   "options": an array of strings representing the possible answers.
   "correctAnswer": a string that is exactly one of the options, representing the correct answer.
-Optionally, you may include an "explanation" key with a brief explanation.
-Ensure that the output is ONLY a valid JSON array of such objects, with no additional commentary or markdown.
-{user_instr}
-Transcript:
-\"\"\"{transcript_chunk}\"\"\"
+  "explanation": a brief explanation of the correct answer.
+Output a JSON object whose "questions" array holds these question objects.
 """
+
+@functools.lru_cache(maxsize=64)
+def interactive_prompt_builder(user_preferences=""):
+    """Interactive-question counterpart of anki_prompt_builder."""
+    user_instr = ""
+    if user_preferences.strip():
+        user_instr = f'User Request: {user_preferences.strip()}\nIf no content relevant to the user request is found in this chunk, output a dummy question in the required JSON format.\n'
+    prefix = user_instr + TRANSCRIPT_OPEN_TAG
+
+    def build(transcript_chunk):
+        return prefix + escape_transcript_chunk(transcript_chunk) + TRANSCRIPT_CLOSE_TAG
+    return build
+
+def get_interactive_questions_for_chunk(transcript_chunk, user_preferences="", model=DEFAULT_MODEL, errors=None, use_cache=True, semantic_threshold=None):
+    """
+    Calls the OpenAI API with a transcript chunk and returns a list of interactive multiple-choice questions.
+    Each question is a JSON object with keys: "question", "options", "correctAnswer" (and optionally "explanation").
+    Problems are flashed, or appended to `errors` when one is given.
+    """
+    model = resolve_model(model, transcript_chunk)
+    cached, remember = lookup_chunk_cache("interactive", model, user_preferences, transcript_chunk, use_cache, semantic_threshold)
+    if cached is not None:
+        return cached
+    prompt = interactive_prompt_builder(user_preferences)(transcript_chunk)
+    partial = []
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=2000,
-            timeout=60
-        )
-        result_text = response.choices[0].message.content.strip()
-        logger.debug("Raw API response for interactive questions: %s", result_text)
-        try:
-            questions = json.loads(result_text)
-            if isinstance(questions, list):
+        for temperature in CHUNK_ATTEMPT_TEMPERATURES:
+            closed = []
+            questions, result_text = collect_json_array_completion(
+                INTERACTIVE_SYSTEM_PROMPT, prompt, model, max_tokens=2000, response_format=INTERACTIVE_RESPONSE_FORMAT,
+                temperature=temperature, closed=closed,
+            )
+            logger.info("API response for interactive questions: %d chars", len(result_text))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Raw API response for interactive questions: %s", result_text)
+            if questions and not closed:
+                # Cut off (e.g. at max_tokens) after some questions: keep them
+                # in case the retry does no better, but never cache them.
+                logger.warning("Truncated interactive response at temperature %s", temperature)
+                partial = questions
+                continue
+            if not questions:
+                questions = parse_json_array_response(result_text, "questions", "interactive questions")
+            if questions is not None:
+                remember(questions)
                 return questions
-        except Exception as parse_err:
-            logger.error("JSON parsing error for interactive questions: %s", parse_err)
-            start_idx = result_text.find('[')
-            end_idx = result_text.rfind(']')
-            if start_idx != -1 and end_idx != -1:
-                json_str = result_text[start_idx:end_idx+1]
-                try:
-                    questions = json.loads(json_str)
-                    if isinstance(questions, list):
-                        return questions
-                except Exception as e:
-                    logger.error("Fallback JSON parsing failed for interactive questions: %s", e)
-        flash("Failed to generate interactive questions for a chunk. API response: " + result_text)
+            logger.warning("Unparsable interactive response at temperature %s", temperature)
+        if partial:
+            report_chunk_error("The response for a chunk was cut off; some of its questions may be missing.", errors)
+            return partial
+        report_chunk_error("Failed to generate interactive questions for a chunk. API response: " + response_excerpt(result_text), errors)
         return []
     except Exception as e:
         logger.error("OpenAI API error for interactive questions: %s", e)
-        flash("OpenAI API error for a chunk: " + str(e))
+        report_chunk_error("OpenAI API error for a chunk: " + str(e), errors)
         return []
 
-def get_all_interactive_questions(transcript, user_preferences="", max_chunk_size=4000, model="gpt-4o"):
+def get_all_interactive_questions(transcript, user_preferences="", max_chunk_size=4000, model=DEFAULT_MODEL, use_cache=True, semantic_threshold=None, max_workers=MAX_CHUNK_WORKERS):
     """
     Preprocesses the transcript, splits it into chunks, and processes each chunk to generate interactive questions.
-    Returns a combined list of all questions.
+    Returns a combined list of all questions with their options already shuffled.
     """
-    cleaned_transcript = preprocess_transcript(transcript)
-    logger.debug("Cleaned transcript (first 200 chars): %s", cleaned_transcript[:200])
-    chunks = chunk_text(cleaned_transcript, max_chunk_size)
-    all_questions = []
-    for i, chunk in enumerate(chunks):
-        logger.debug("Processing chunk %d/%d for interactive questions", i+1, len(chunks))
-        questions = get_interactive_questions_for_chunk(chunk, user_preferences, model=model)
-        logger.debug("Chunk %d produced %d interactive questions.", i+1, len(questions))
-        all_questions.extend(questions)
+    key = deck_cache_key("interactive", transcript, user_preferences, model, max_chunk_size)
+    all_questions = chunk_cache.get(key) if use_cache else None
+    if all_questions is not None:
+        logger.debug("Cache hit for the whole question set")
+    else:
+        chunks = clean_and_chunk(transcript, max_chunk_size)
+        logger.debug("Processing %d chunks for interactive questions", len(chunks))
+        errors = []
+        results = map_chunks_in_parallel(
+            lambda chunk: get_interactive_questions_for_chunk(chunk, user_preferences, model=model, errors=errors, use_cache=use_cache, semantic_threshold=semantic_threshold),
+            chunks,
+            max_workers=max_workers,
+        )
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, questions in enumerate(results):
+                logger.debug("Chunk %d produced %d interactive questions.", i+1, len(questions))
+        all_questions = list(chain.from_iterable(results))
+        for message in errors:
+            flash(message)
+        # Partial sets (some chunk failed) are not cached, so a retry can fill them in.
+        if all_questions and not errors:
+            chunk_cache.set(key, all_questions)
     logger.debug("Total interactive questions generated: %d", len(all_questions))
-    return all_questions
+    # Shuffle copies so cached question dicts keep their original order.
+    return [
+        dict(q, options=random.sample(q["options"], len(q["options"])))
+        for q in all_questions
+    ]
 
-# ----------------------------
-# Embedded HTML Templates
-# ----------------------------
-# ✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️ INDEX_HTML TEMPLATE ✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️
-# ✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️ INDEX_HTML TEMPLATE ✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️
-# ✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️ INDEX_HTML TEMPLATE ✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️
-# ✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️ INDEX_HTML TEMPLATE ✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️
-INDEX_HTML = """
-<!DOCTYPE html>
-<html>
-<head>
-  <meta charset="UTF-8">
-  <meta name="viewport" content="width=device-width, initial-scale=1, user-scalable=no">
-  <title>Transcript to Anki Cards or Interactive Game</title>
-  <style>
-    /* Remove tap highlight on mobile */
-    button { -webkit-tap-highlight-color: transparent; }
-    /* Remove focus outline */
-    button:focus, input:focus { outline: none; }
-    body { background-color: #1E1E20; color: #D7DEE9; font-family: Arial, sans-serif; text-align: center; padding-top: 50px; }
-    textarea, input[type="text"], select {
-      width: 80%;
-      padding: 10px;
-      font-size: 16px;
-      margin-bottom: 10px;
-      background-color: #2F2F31;
-      color: #D7DEE9;
-      border: 1px solid #444;
-      border-radius: 5px;
-    }
-    textarea { height: 200px; }
-    input[type="submit"] { 
-      padding: 10px 20px; 
-      font-size: 16px; 
-      margin-top: 10px; 
-      background-color: #6200ee; 
-      color: #fff; 
-      border: none; 
-      border-radius: 5px; 
-      cursor: pointer; 
-      transition: background-color 0.3s;
-    }
-    input[type="submit"]:hover { background-color: #3700b3; }
-    .flash { color: red; }
-    a { color: #6BB0F5; text-decoration: none; }
-    a:hover { text-decoration: underline; }
-    #advancedToggle {
-      cursor: pointer;
-      color: #bb86fc;
-      font-weight: bold;
-      margin-bottom: 10px;
-    }
-    #advancedOptions {
-      width: 80%;
-      margin: 0 auto 20px;
-      text-align: left;
-      background-color: #2F2F31;
-      padding: 10px;
-      border: 1px solid #444;
-      border-radius: 5px;
-    }
-    #advancedOptions label { display: block; margin-bottom: 5px; }
-    .button-group {
-      display: flex;
-      flex-direction: column;
-      gap: 10px;
-      align-items: center;
-    }
-    .button-group input[type="submit"] {
-      width: 80%;
-      max-width: 300px;
-    }
-    /* Loading Overlay Styles */
-    #loadingOverlay {
-      position: fixed;
-      top: 0;
-      left: 0;
-      width: 100%;
-      height: 100%;
-      background: #121212;
-      display: none;
-      flex-direction: column;
-      justify-content: center;
-      align-items: center;
-      z-index: 9999;
-    }
-  </style>
-  <!-- Include Lottie for the loading animation -->
-  <script src="https://cdnjs.cloudflare.com/ajax/libs/bodymovin/5.7.6/lottie.min.js"></script>
-</head>
-<body>
-  <div id="loadingOverlay">
-    <div id="lottieContainer" style="width: 300px; height: 300px;"></div>
-    <div id="loadingText" style="color: #D7DEE9; margin-top: 20px; font-size: 18px;">Generating. Please wait...</div>
-  </div>
-  <h1>Transcript to Anki Cards or Interactive Game</h1>
-    <p>
-      Don't have a transcript? Use the
-      <a href="https://tactiq.io/tools/youtube-transcript" target="_blank">
-        Tactiq.io transcript tool
-      </a>
-      or
-      <a href="https://www.youtube-transcript.io/" target="_blank">
-        Youtube Transcript Generator
-      </a>
-      to generate one.
-    </p>
-  {% with messages = get_flashed_messages() %}
-    {% if messages %}
-      {% for message in messages %}
-        <div class="flash">{{ message }}</div>
-      {% endfor %}
-    {% endif %}
-  {% endwith %}
-  <form id="transcriptForm">
-    <!-- Advanced Options Toggle -->
-    <div id="advancedToggle" onclick="toggleAdvanced()">Advanced Options ▼</div>
-    <div id="advancedOptions" style="display: none;">
-      <label for="modelSelect">Model:</label>
-      <select name="model" id="modelSelect">
-        <option value="gpt-4.1-nano">gpt-4.1-nano</option>
-        <option value="gpt-4.1-mini">gpt-4.1-mini</option>
-        <option value="gpt-4.1" selected>gpt-4.1</option>
-        <option value="gpt-4o-mini">gpt-4o-mini</option>
-        <option value="gpt-4o">gpt-4o</option>
-      </select>
-      <br>
-      <label for="maxSize">Max Chunk Size (characters):</label>
-      <input type="text" name="max_size" id="maxSize" value="10000">
-    </div>
-    <textarea name="transcript" placeholder="Paste your transcript here" required></textarea>
-    <br>
-    <input type="text" name="preferences" placeholder="Enter your card preferences (optional)">
-    <br>
-    <div class="button-group">
-      <input type="submit" name="mode" value="Generate Anki Cards">
-      <input type="submit" name="mode" value="Generate Game">
-    </div>
-  </form>
-  <script>
-    function toggleAdvanced(){
-      var adv = document.getElementById("advancedOptions");
-      var toggle = document.getElementById("advancedToggle");
-      if(adv.style.display === "none" || adv.style.display === ""){
-          adv.style.display = "block";
-          toggle.innerHTML = "Advanced Options ▲";
-      } else {
-          adv.style.display = "none";
-          toggle.innerHTML = "Advanced Options ▼";
-      }
-    }
-    document.getElementById("transcriptForm").addEventListener("submit", function(event) {
-      event.preventDefault();
-      // Show the loading overlay immediately
-      var overlay = document.getElementById("loadingOverlay");
-      overlay.style.display = "flex";
-      // Delay Lottie initialization slightly so the container is rendered
-      setTimeout(function() {
-        lottie.loadAnimation({
-          container: document.getElementById('lottieContainer'),
-          renderer: 'svg',
-          loop: true,
-          autoplay: true,
-          path: 'https://lottie.host/embed/4500dbaf-9ac9-4b2b-b664-692cd9a3ccab/BGvTKQT8Tx.json'
-        });
-      }, 50);
-      var form = event.target;
-      var formData = new FormData(form);
-      // Use the clicked submit button’s value (if available) to set the mode
-      if(event.submitter && event.submitter.value) {
-          formData.set("mode", event.submitter.value);
-      }
-      // Send the form data via fetch to the new /generate endpoint
-      fetch("/generate", {
-        method: "POST",
-        body: formData
-      })
-      .then(response => response.text())
-      .then(html => {
-        // Replace the current document with the returned HTML
-        document.open();
-        document.write(html);
-        document.close();
-      })
-      .catch(error => {
-        console.error("Error:", error);
-        alert("An error occurred. Please try again.");
-        overlay.style.display = "none";
-      });
-    });
-  </script>
-  <!-- Keep-alive ping -->
-  <script>
-    setInterval(() => fetch("/ping").catch(()=>{}), 2 * 60 * 1000);
-  </script>
-</body>
-</html>
-"""
-# ✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️ INDEX_HTML TEMPLATE ✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️
-# ✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️ INDEX_HTML TEMPLATE ✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️
-# ✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️ INDEX_HTML TEMPLATE ✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️
-# ✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️ INDEX_HTML TEMPLATE ✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️
-# ✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️ INDEX_HTML TEMPLATE ✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️✏️
-# 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠 ANKI_HTML TEMPLATE 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠
-# 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠 ANKI_HTML TEMPLATE 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠
-# 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠 ANKI_HTML TEMPLATE 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠
-# 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠 ANKI_HTML TEMPLATE 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠
-# 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠 ANKI_HTML TEMPLATE 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠
-ANKI_HTML = """
-<!DOCTYPE html>
-<html>
-<head>
-  <meta charset="UTF-8">
-  <meta name="viewport" content="width=device-width, initial-scale=1.0, user-scalable=no">
-  <title>Anki Cloze Review</title>
-  <style>
-    /* Remove tap highlight on mobile */
-    button { -webkit-tap-highlight-color: transparent; }
-    /* Remove focus outline */
-    button:focus { outline: none; }
-    html, body { height: 100%; margin: 0; padding: 0; }
-    html { touch-action: manipulation; } /* Add this line */
-    body { background-color: #1E1E20; font-family: helvetica, Arial, sans-serif; }
-    #reviewContainer {
-      display: flex;
-      flex-direction: column;
-      align-items: center;
-      padding: 10px;
-      min-height: 100vh;
-      justify-content: center;
-    }
-    #progress { width: 100%; max-width: 700px; text-align: center; color: #A6ABB9; margin-bottom: 10px; }
-    #kard {
-      background-color: #2F2F31;
-      border-radius: 5px;
-      padding: 20px;
-      max-width: 700px;
-      width: 100%;
-      min-height: 50vh;
-      display: flex;
-      align-items: center;
-      justify-content: center;
-      text-align: center;
-      word-wrap: break-word;
-      margin-bottom: 20px;
-    }
-    .card { font-size: 20px; color: #D7DEE9; line-height: 1.6em; }
-    #editArea { width: 100%; height: 150px; font-size: 20px; padding: 10px; }
-    .cloze, .cloze b, .cloze u, .cloze i { font-weight: bold; color: MediumSeaGreen !important; cursor: pointer; }
-    #actionControls { display: none; justify-content: space-between; width: 100%; max-width: 700px; margin: 10px auto; }
-    .actionButton { padding: 10px 20px; font-size: 16px; border: none; color: #fff; border-radius: 5px; cursor: pointer; flex: 1; margin: 0 5px; }
-    .discard { background-color: red; }
-    .save { background-color: green; }
-    #bottomUndo, #bottomEdit {
-      display: flex;
-      justify-content: center;
-      width: 100%;
-      max-width: 700px;
-      margin: 5px auto;
-      padding: 0 10px;
-    }
-    .bottomButton {
-      padding: 10px 20px;
-      font-size: 16px;
-      border: none;
-      color: #fff;
-      border-radius: 5px;
-      cursor: pointer;
-      flex: 1;
-      margin: 0 5px;
-      background-color: #6200ee;
-      transition: background-color 0.3s;
-    }
-    .bottomButton:hover { background-color: #3700b3; }
-    .undo { }
-    .edit { background-color: #FFA500; }
-    #editControls { display: none; justify-content: space-between; width: 100%; max-width: 700px; margin: 10px auto; }
-    .editButton { padding: 10px 20px; font-size: 16px; border: none; color: #fff; border-radius: 5px; cursor: pointer; flex: 1; margin: 0 5px; }
-    .cancelEdit { background-color: gray; }
-    .saveEdit { background-color: green; }
-    #savedCardsContainer { 
-      width: 100%; max-width: 700px; margin: 20px auto; color: #D7DEE9; 
-      display: none; 
-      /* Ensure saved cards screen is also centered */
-      display: flex;
-      flex-direction: column;
-      align-items: center;
-    }
-    #savedCardsText {
-      width: 100%;
-      height: 200px;
-      padding: 10px;
-      font-size: 16px;
-      background-color: #2F2F31;
-      border: none;
-      border-radius: 5px;
-      resize: none;
-      color: #D7DEE9;
-    }
-    #copyButton, #returnButton {
-      margin-top: 10px;
-      padding: 10px 20px;
-      font-size: 16px;
-      background-color: #4A90E2;
-      color: #fff;
-      border: none;
-      border-radius: 5px;
-      cursor: pointer;
-    }
-    /* New Download Button Styling */
-    #downloadButton {
-      margin-top: 10px;
-      padding: 10px 20px;
-      font-size: 16px;
-      background-color: #03A9F4;
-      color: #fff;
-      border: none;
-      border-radius: 5px;
-      cursor: pointer;
-    }
-    #cartContainer {
-      display: flex;
-      justify-content: center;
-      margin: 5px auto;
-      width: 100%;
-      max-width: 700px;
-      padding: 0 10px;
-    }
-    .cart.bottomButton {
-      background-color: #03A9F4;
-    }
-    .cart.bottomButton:hover {
-      background-color: #0288D1;
-    }
-    /* Loading Overlay Styles */
-    #loadingOverlay {
-      position: fixed;
-      top: 0;
-      left: 0;
-      width: 100%;
-      height: 100%;
-      background: #121212;
-      display: flex;
-      justify-content: center;
-      align-items: center;
-      z-index: 9999;
-    }
-  </style>
-  <script src="https://cdnjs.cloudflare.com/ajax/libs/bodymovin/5.7.6/lottie.min.js"></script>
-</head>
-<body>
-  <!-- Loading Overlay -->
-  <div id="loadingOverlay">
-    <div id="lottieContainer" style="width: 300px; height: 300px;"></div>
-  </div>
-  <div id="reviewContainer" style="display: none;">
-    <div id="progress">Card <span id="current">0</span> of <span id="total">0</span></div>
-    <div id="kard">
-      <div class="card" id="cardContent"></div>
-    </div>
-    <div id="actionControls">
-      <button id="discardButton" class="actionButton discard" onmousedown="event.preventDefault()" ontouchend="this.blur()">Discard</button>
-      <button id="saveButton" class="actionButton save" onmousedown="event.preventDefault()" ontouchend="this.blur()">Save</button>
-    </div>
-    <div id="editControls">
-      <button id="cancelEditButton" class="editButton cancelEdit" onmousedown="event.preventDefault()" ontouchend="this.blur()">Cancel Edit</button>
-      <button id="saveEditButton" class="editButton saveEdit" onmousedown="event.preventDefault()" ontouchend="this.blur()">Save Edit</button>
-    </div>
-    <!-- START: Add this new div and its buttons right AFTER the closing </div id="editControls"> -->
-    <div id="clozeEditControls" style="display: none; justify-content: space-around; width: 100%; max-width: 700px; margin: 10px auto;">
-      <button id="removeAllClozeButton" class="editButton" style="background-color: #dc3545;" onmousedown="event.preventDefault()" ontouchend="this.blur()">Remove All Cloze</button>
-      <button id="addClozeButton" class="editButton" style="background-color: #007bff;" onmousedown="event.preventDefault()" ontouchend="this.blur()">Add Cloze</button>
-    </div>
-    <!-- END: Add this new div and its buttons -->
-    <div id="bottomUndo">
-      <button id="undoButton" class="bottomButton undo" onmousedown="event.preventDefault()" ontouchend="this.blur()">Previous Card</button>
-    </div>
-    <div id="bottomEdit">
-      <button id="editButton" class="bottomButton edit" onmousedown="event.preventDefault()" ontouchend="this.blur()">Edit</button>
-    </div>
-    <div id="cartContainer">
-      <button id="cartButton" class="bottomButton cart" onmousedown="event.preventDefault()" ontouchend="this.blur()">Saved Cards</button>
-    </div> <!-- This closes cartContainer -->
-    
-    <!-- START: Add this new div and button for TTS -->
-    <div id="ttsContainer" style="display: flex; justify-content: center; margin: 5px auto; width: 100%; max-width: 700px; padding: 0 10px;">
-        <button id="ttsToggleButton" class="bottomButton" style="background-color: grey;" onmousedown="event.preventDefault()" ontouchend="this.blur()">TTS: Off</button>
-    </div>
-    <!-- END: Add this new div and button for TTS -->
-
-    <div id="savedCardsContainer">
-        <!-- Rest of the savedCardsContainer content... -->
-    <div id="savedCardsContainer">
-      <h3 id="finishedHeader" style="text-align:center;">Saved Cards</h3>
-      <textarea id="savedCardsText" readonly></textarea>
-      <div style="text-align:center;">
-        <button id="copyButton" onmousedown="event.preventDefault()" ontouchend="this.blur()">Copy Saved Cards</button>
-      </div>
-      <div style="text-align:center; margin-top:10px;">
-        <button id="returnButton" class="bottomButton return" onmousedown="event.preventDefault()" ontouchend="this.blur()">Return to Card</button>
-      </div>
-      <div style="text-align:center; margin-top:10px;">
-        <button id="downloadButton" class="bottomButton" onmousedown="event.preventDefault()" ontouchend="this.blur()">Download APKG</button>
-      </div>
-    </div>
-  </div>
-  <script>
-    // Initialize Lottie animation
-    var animation = lottie.loadAnimation({
-      container: document.getElementById('lottieContainer'),
-      renderer: 'svg',
-      loop: true,
-      autoplay: true,
-      path: 'https://lottie.host/embed/4500dbaf-9ac9-4b2b-b664-692cd9a3ccab/BGvTKQT8Tx.json'
-    });
-    // Once the page has fully loaded, hide the loading overlay and show the review container.
-    window.addEventListener('load', function() {
-      var overlay = document.getElementById('loadingOverlay');
-      var reviewContainer = document.getElementById('reviewContainer');
-      overlay.style.transition = 'opacity 0.5s ease';
-      overlay.style.opacity = '0';
-      setTimeout(function() {
-        overlay.style.display = 'none';
-        reviewContainer.style.display = 'flex';
-      }, 500);
-    });
-  </script>
-  <script>
-    const cards = {{ cards_json|safe }};
-{% raw %}
-    let interactiveCards = [];
-    function generateInteractiveCards(cardText) {
-      const regex = /{{c(\d+)::(.*?)}}/g;
-      const numbers = new Set();
-      let m;
-      while ((m = regex.exec(cardText)) !== null) {
-        numbers.add(m[1]);
-      }
-      if (numbers.size === 0) {
-        return [{ target: null, displayText: cardText, exportText: cardText }];
-      }
-      const cardsForNote = [];
-      Array.from(numbers).sort().forEach(num => {
-        const display = processCloze(cardText, num);
-        cardsForNote.push({ target: num, displayText: display, exportText: cardText });
-      });
-      return cardsForNote;
-    }
-    function processCloze(text, target) {
-      // Regex to capture cloze number, answer text, and optional hint
-      const regex = /{{c(\d+)::(.*?)(?:::([^}]+))?}}/g; 
-      return text.replace(regex, function(match, clozeNum, answer, hint) {
-        const hintText = hint ? hint.trim() : ''; // Get hint or empty string
-        // Display the hint inside the brackets if it exists, otherwise [...]
-        const displayContent = hintText ? `[${hintText}]` : '[...]'; 
-        if (clozeNum === target) {
-          // Store both answer and hint (even if empty) in data attributes
-          return `<span class="cloze" data-answer="${answer.replace(/"/g, '"')}" data-hint="${hintText.replace(/"/g, '"')}">${displayContent}</span>`;
-        } else {
-          // For non-target clozes, just show the answer text directly
-         return answer; 
-        }
-      });
-    }
-// END of replacement for processCloze
-    cards.forEach(cardText => {
-      interactiveCards = interactiveCards.concat(generateInteractiveCards(cardText));
-    });
-    // START: Add these new TTS variables and functions
-let isTtsEnabled = false; // TTS is off by default
-const synth = window.speechSynthesis; // Get the speech synthesis interface
-
-function speakText(text) {
-    if (!isTtsEnabled || !text || !text.trim()) return; // Only speak if enabled and text exists
-    synth.cancel(); // Stop any previous speech
-    const utterance = new SpeechSynthesisUtterance(text);
-    // Optional: You could add configurations like language, rate, pitch here
-    // utterance.lang = 'en-US';
-    // utterance.rate = 1;
-    // utterance.pitch = 1;
-    synth.speak(utterance);
-}
-
-function getFrontTextToSpeak(cardElement) {
-    // Clone the card content to avoid modifying the displayed card directly
-    const tempDiv = cardElement.cloneNode(true);
-    
-    // Find all cloze spans within the cloned content
-    const clozeSpans = tempDiv.querySelectorAll('.cloze');
-
-    clozeSpans.forEach(span => {
-        const hint = span.dataset.hint;
-        // Replace the span node with a text node containing the hint or "blank"
-        const replacementText = document.createTextNode(" " + (hint ? hint : "blank") + " ");
-        span.parentNode.replaceChild(replacementText, span);
-    });
-
-    // Get the text content after replacements, clean up whitespace
-    let textToSpeak = (tempDiv.textContent || tempDiv.innerText || "").replace(/\s+/g, ' ').trim();
-    return textToSpeak;
-}
-
-function stopSpeech() {
-    if (synth.speaking) {
-        synth.cancel();
-    }
-}
-// END: Add these new TTS variables and functions
-    let currentIndex = 0;
-    let savedCards = [];
-    let historyStack = [];
-    let inEditMode = false;
-    let finished = false;
-    let savedCardIndex = null; // For cart functionality
-
-    const currentEl = document.getElementById("current");
-    const totalEl = document.getElementById("total");
-    const cardContentEl = document.getElementById("cardContent");
-    const actionControls = document.getElementById("actionControls");
-    const bottomUndo = document.getElementById("bottomUndo");
-    const bottomEdit = document.getElementById("bottomEdit");
-    const undoButton = document.getElementById("undoButton");
-    const editButton = document.getElementById("editButton");
-    const discardButton = document.getElementById("discardButton");
-    const saveButton = document.getElementById("saveButton");
-    const editControls = document.getElementById("editControls");
-    const saveEditButton = document.getElementById("saveEditButton");
-    const cancelEditButton = document.getElementById("cancelEditButton");
-    const savedCardsContainer = document.getElementById("savedCardsContainer");
-    const finishedHeader = document.getElementById("finishedHeader");
-    const savedCardsText = document.getElementById("savedCardsText");
-    const copyButton = document.getElementById("copyButton");
-    const cartButton = document.getElementById("cartButton");
-    const returnButton = document.getElementById("returnButton");
-    const cartContainer = document.getElementById("cartContainer");
-    const ttsToggleButton = document.getElementById("ttsToggleButton"); 
-    const clozeEditControls = document.getElementById("clozeEditControls");
-    const removeAllClozeButton = document.getElementById("removeAllClozeButton");
-    const addClozeButton = document.getElementById("addClozeButton");
-
-    totalEl.textContent = interactiveCards.length;
-
-    function updateUndoButtonState() {
-      undoButton.disabled = historyStack.length === 0;
-    }
-    updateUndoButtonState();
-    
-    document.getElementById("kard").addEventListener("click", function(e) {
-      if (inEditMode) return;
-      // Only proceed if the answer hasn't been shown yet
-      if (actionControls.style.display === "none" || actionControls.style.display === "") { 
-        stopSpeech(); // Stop front-side speech if it's still going
-        const clozes = document.querySelectorAll("#cardContent .cloze");
-        let answersToSpeak = []; // Collect answers to speak
-    
-        clozes.forEach(span => {
-          const answer = span.getAttribute("data-answer");
-          answersToSpeak.push(answer); // Add answer for speaking
-          span.innerHTML = answer;     // Visually reveal the answer
-          // Optional: remove the cloze class to prevent re-clicking/styling issues
-          // span.classList.remove('cloze'); 
-        });
-
-        actionControls.style.display = "flex"; // Show Save/Discard buttons
-    
-        // Speak the collected answers (joined by comma-space)
-        speakText(answersToSpeak.join(", ")); 
-      }
-    });
-    // START: Add this block to initialize TTS button
-    ttsToggleButton.textContent = `TTS: ${isTtsEnabled ? 'On' : 'Off'}`;
-    ttsToggleButton.style.backgroundColor = isTtsEnabled ? '#03A9F4' : 'grey';
-    // END: Add this block
-    function showCard() {
-      stopSpeech(); // Stop any speech from previous card/action
-      finished = false;
-      document.getElementById("progress").textContent = "Card " + (currentIndex+1) + " of " + interactiveCards.length;
-      if (!inEditMode) {
-        actionControls.style.display = "none";
-      }
-      // MAKE SURE this line comes BEFORE getFrontTextToSpeak
-      cardContentEl.innerHTML = interactiveCards[currentIndex].displayText; 
-
-      // Ensure the card content remains vertically centered.
-      document.getElementById("kard").style.display = "flex";
-      savedCardsContainer.style.display = "none";
-      // Restore buttons if coming back from finished state.
-      document.getElementById("bottomEdit").style.display = "flex";
-      document.getElementById("cartContainer").style.display = "flex";
-      document.getElementById("returnButton").style.display = "none";
-      
-      // START: Add TTS call for front side
-      const frontText = getFrontTextToSpeak(cardContentEl);
-      speakText(frontText);
-      // END: Add TTS call
-    }
-    function nextCard() {
-      if (currentIndex < interactiveCards.length - 1) {
-          currentIndex++;
-          showCard();
-      } else {
-          finished = true;
-      }
-    }
-    // Modify the save and discard button event handlers:
-    discardButton.addEventListener("click", function(e) {
-      e.stopPropagation();
-      stopSpeech(); // ADD THIS LINE
-      historyStack.push({ currentIndex: currentIndex, savedCards: savedCards.slice(), finished: finished });
-      updateUndoButtonState();
-      if (currentIndex === interactiveCards.length - 1) {
-          finished = true;
-          showFinished();
-      } else {
-          nextCard();
-      }
-    });
-    saveButton.addEventListener("click", function(e) {
-      e.stopPropagation();
-      historyStack.push({ currentIndex: currentIndex, savedCards: savedCards.slice(), finished: finished });
-      updateUndoButtonState();
-      savedCards.push(interactiveCards[currentIndex].exportText);
-      if (currentIndex === interactiveCards.length - 1) {
-          finished = true;
-          showFinished();
-      } else {
-          nextCard();
-      }
-    });
-
-    function showFinished() {
-      // Hide card display and action controls, update header and show finish screen.
-      document.getElementById("kard").style.display = "none";
-      actionControls.style.display = "none";
-      finishedHeader.textContent = "Review complete!";
-      savedCardsText.value = savedCards.join("\\n");
-      savedCardsContainer.style.display = "flex";
-      // Update progress to show "Review Complete"
-      document.getElementById("progress").textContent = "Review Complete";
-      // Hide buttons that should not appear on the finish screen.
-      document.getElementById("bottomEdit").style.display = "none";
-      document.getElementById("cartContainer").style.display = "none";
-      document.getElementById("returnButton").style.display = "none";
-    }
-
-    editButton.addEventListener("click", function(e) {
-      e.stopPropagation();
-      if (!inEditMode) enterEditMode();
-    });
-    function enterEditMode() {
-      stopSpeech(); // ADD THIS LINE
-      inEditMode = true;
-      originalCardText = interactiveCards[currentIndex].exportText;
-      cardContentEl.innerHTML = '<textarea id="editArea">' + interactiveCards[currentIndex].exportText + '</textarea>';
-      actionControls.style.display = "none";
-      bottomUndo.style.display = "none";
-      bottomEdit.style.display = "none";
-      editControls.style.display = "flex";
-      clozeEditControls.style.display = "flex"; // Add this line
-    }
-    saveEditButton.addEventListener("click", function(e) {
-      e.stopPropagation();
-      const editedText = document.getElementById("editArea").value;
-      interactiveCards[currentIndex].exportText = editedText;
-      let target = interactiveCards[currentIndex].target;
-      if (target) {
-        interactiveCards[currentIndex].displayText = processCloze(editedText, target);
-      } else {
-        interactiveCards[currentIndex].displayText = editedText;
-      }
-      inEditMode = false;
-      editControls.style.display = "none";
-      clozeEditControls.style.display = "none"; // Add this line
-      bottomUndo.style.display = "flex";
-      bottomEdit.style.display = "flex";
-      showCard();
-    });
-    cancelEditButton.addEventListener("click", function(e) {
-      e.stopPropagation();
-      inEditMode = false;
-      editControls.style.display = "none";
-      clozeEditControls.style.display = "none"; // Add this line
-      bottomUndo.style.display = "flex";
-      bottomEdit.style.display = "flex";
-      showCard();
-    });
-
-// START: Add Cloze Editing Logic
-
-// Function to remove all cloze deletions from the editor
-removeAllClozeButton.addEventListener("click", function(e) {
-    e.stopPropagation();
-    const editArea = document.getElementById("editArea");
-    if (!editArea) return; // Should not happen in edit mode
-
-    const currentText = editArea.value;
-    // Regex to find {{c<number>::<content>}}
-    const clozeRegex = /{{c\d+::(.*?)}}/g;
-    // Replace the whole cloze tag with just the content inside
-    const cleanedText = currentText.replace(clozeRegex, '$1');
-
-    editArea.value = cleanedText;
-});
-
-// Function to add a new cloze deletion around selected text
-addClozeButton.addEventListener("click", function(e) {
-    e.stopPropagation();
-    const editArea = document.getElementById("editArea");
-    if (!editArea) return; // Should not happen
-
-    const start = editArea.selectionStart;
-    const end = editArea.selectionEnd;
-    const selectedText = editArea.value.substring(start, end);
-
-    if (!selectedText) {
-        alert("Please select the text you want to hide.");
-        return;
-    }
-
-    const currentFullText = editArea.value;
-
-    // Find the highest existing cloze number
-    const clozeRegex = /{{c(\d+)::.*?}}/g;
-    let match;
-    let maxClozeNum = 0;
-    while ((match = clozeRegex.exec(currentFullText)) !== null) {
-        const num = parseInt(match[1], 10);
-        if (num > maxClozeNum) {
-            maxClozeNum = num;
-        }
-    }
-
-    const nextClozeNum = maxClozeNum + 1;
-    const newClozeText = `{{c${nextClozeNum}::${selectedText}}}`;
-
-    // Reconstruct the text in the textarea
-    const textBefore = currentFullText.substring(0, start);
-    const textAfter = currentFullText.substring(end);
-    editArea.value = textBefore + newClozeText + textAfter;
-
-    // Optional: Keep the newly added cloze selected (or place cursor after it)
-    editArea.focus();
-    editArea.selectionStart = start + newClozeText.length;
-    editArea.selectionEnd = start + newClozeText.length;
-});
-
-// END: Add Cloze Editing Logic
-
-
-
-    // FIX: Always call showCard() when undoing so that the progress text is updated.
-    undoButton.addEventListener("click", function(e) {
-      e.stopPropagation();
-      if (historyStack.length === 0) {
-        alert("No actions to undo.");
-        return;
-      }
-      let snapshot = historyStack.pop();
-      currentIndex = snapshot.currentIndex;
-      savedCards = snapshot.savedCards.slice();
-      finished = snapshot.finished;
-      finished = false; // reset finished state
-      showCard();  // update entire display including progress
-      updateUndoButtonState();
-    });
-
-    copyButton.addEventListener("click", function() {
-      savedCardsText.select();
-      document.execCommand("copy");
-      copyButton.textContent = "Copied!";
-      setTimeout(function() {
-        copyButton.textContent = "Copy Saved Cards";
-      }, 2000);
-    });
-
-    // START: Add TTS Toggle Button Listener
-    ttsToggleButton.addEventListener("click", function(e) {
-        e.stopPropagation();
-        isTtsEnabled = !isTtsEnabled; // Toggle the state
-    
-        // Update button appearance
-        this.textContent = `TTS: ${isTtsEnabled ? 'On' : 'Off'}`;
-        this.style.backgroundColor = isTtsEnabled ? '#03A9F4' : 'grey'; 
-    
-        if (isTtsEnabled) {
-            // If TTS was just turned on, try to speak the current card's front side
-            // Check if we are viewing the front of a card (answer not revealed)
-            if (!inEditMode && (actionControls.style.display === "none" || actionControls.style.display === "") && !finished) {
-                 const frontText = getFrontTextToSpeak(cardContentEl);
-                 speakText(frontText);
-            }
-        } else {
-            stopSpeech(); // If turning TTS off, stop any current speech
-        }
-    });
-    // END: Add TTS Toggle Button Listener
-
-
-    cartButton.addEventListener("click", function(e) {
-      e.stopPropagation();
-      savedCardIndex = currentIndex;
-      document.getElementById("kard").style.display = "none";
-      actionControls.style.display = "none";
-      bottomUndo.style.display = "none";
-      bottomEdit.style.display = "none";
-      cartContainer.style.display = "none";
-      savedCardsText.value = savedCards.join("\\n");
-      savedCardsContainer.style.display = "flex";
-      // Show and update the Return to Card button for non-finished saved cards view.
-      document.getElementById("returnButton").style.display = "block";
-      document.getElementById("returnButton").textContent = "Return to Card " + (savedCardIndex+1);
-    });
-    returnButton.addEventListener("click", function(e) {
-      e.stopPropagation();
-      if (savedCardIndex !== null) {
-        currentIndex = savedCardIndex;
-      }
-      savedCardsContainer.style.display = "none";
-      document.getElementById("kard").style.display = "flex";
-      actionControls.style.display = "none";
-      bottomUndo.style.display = "flex";
-      bottomEdit.style.display = "flex";
-      cartContainer.style.display = "flex";
-      showCard();
-    });
-
-    showCard();
-// START: Add Keyboard Shortcut Listener
-    document.addEventListener('keydown', function(event) {
-        // Ignore shortcuts if in edit mode, finished screen, or cart view is active
-        if (inEditMode || finished || savedCardsContainer.style.display === 'flex') {
-            return; 
-        }
-
-        // Determine card state
-        const isFrontSide = (actionControls.style.display === "none" || actionControls.style.display === "");
-        const isBackSide = !isFrontSide;
-
-        switch (event.code) {
-            case 'Space':
-                event.preventDefault(); // Prevent page scrolling
-                if (isFrontSide) {
-                    // Simulate click on card to reveal answer
-                    cardContentEl.click(); 
-                } else { // isBackSide
-                    // Simulate click on Save button
-                    saveButton.click(); 
-                }
-                break;
-
-            case 'ArrowLeft':
-                if (isBackSide) {
-                    event.preventDefault(); 
-                    // Simulate click on Discard button
-                    discardButton.click(); 
-                }
-                // No action on front side for Left Arrow
-                break;
-
-            case 'F4':
-                event.preventDefault(); // Prevent browser default F4 actions
-                
-                // --- Get Front Text representation for speaking ---
-                // Create a temporary element from the stored display text to process it
-                const tempDivFront = document.createElement('div');
-                tempDivFront.innerHTML = interactiveCards[currentIndex].displayText; 
-                // Use helper on the temp div to get text with hints/"blank"
-                const frontTextToSpeak = getFrontTextToSpeak(tempDivFront); 
-
-                if (isFrontSide) {
-                    // Replay front audio only
-                    speakText(frontTextToSpeak); 
-                } else { // isBackSide
-                    // Replay front THEN back audio
-                    stopSpeech(); // Stop any current speech first
-
-                    // --- Get Back Text representation for speaking ---
-                    // Find the revealed answers in the *live* DOM
-                    const answerSpans = cardContentEl.querySelectorAll('.cloze[data-answer]'); 
-                    let answersToSpeak = [];
-                    // Use the data-answer which holds the actual cloze content
-                    answerSpans.forEach(span => answersToSpeak.push(span.dataset.answer)); 
-                    const backTextToSpeak = answersToSpeak.join(", ");
-                    
-                    // Create utterance for the front part
-                    const utteranceFront = new SpeechSynthesisUtterance(frontTextToSpeak);
-                    
-                    // Define what happens when the front speech ends
-                    utteranceFront.onend = () => {
-                        // Check TTS is still enabled and we haven't navigated away
-                        if (isTtsEnabled && !inEditMode && !finished && (actionControls.style.display === "flex")) {
-                            speakText(backTextToSpeak); // Speak the back text
-                        }
-                    };
-
-                    // Speak the front part only if TTS is enabled
-                    if (isTtsEnabled) {
-                        synth.speak(utteranceFront); 
-                    }
-                }
-                break;
-
-            case 'F12':
-                 event.preventDefault(); // Prevent browser dev tools opening
-                // Simulate click on Undo (Previous Card) button
-                 undoButton.click(); 
-                break;
-        
-            // New case: Toggle TTS play/pause when "." is pressed.
-                 case 'Period':  // Alternatively, you can check event.key === "."
-                 event.preventDefault();
-                 if (synth.speaking && !synth.paused) {
-                     synth.pause();
-                 } else if (synth.paused) {
-                     synth.resume();
-                 }
-                 break;
-        }
-    });
-    // END: Add Keyboard Shortcut Listener
-
-{% endraw %}
-    // New event listener for downloading the saved cards as an APKG file using Genanki.
-    document.getElementById("downloadButton").addEventListener("click", function() {
-        if (savedCards.length === 0) {
-            alert("No saved cards to download.");
-            return;
-        }
-        fetch("/download_apkg", {
-            method: "POST",
-            headers: {
-                "Content-Type": "application/json"
-            },
-            body: JSON.stringify({ saved_cards: savedCards })
-        })
-        .then(response => {
-            if (!response.ok) {
-                throw new Error("Network response was not ok");
-            }
-            return response.blob();
-        })
-        .then(blob => {
-            const url = window.URL.createObjectURL(blob);
-            const a = document.createElement("a");
-            a.href = url;
-            a.download = "saved_cards.apkg";
-            document.body.appendChild(a);
-            a.click();
-            a.remove();
-            window.URL.revokeObjectURL(url);
-        })
-        .catch(error => {
-            console.error("Download failed:", error);
-            alert("Download failed.");
-        });
-    });
-  </script>
-  <!-- Keep-alive ping -->
-  <script>
-    setInterval(() => fetch("/ping").catch(()=>{}), 2 * 60 * 1000);
-  </script>
-</body>
-</html>
-"""
-# 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠 ANKI_HTML TEMPLATE 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠
-# 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠 ANKI_HTML TEMPLATE 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠
-# 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠 ANKI_HTML TEMPLATE 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠
-# 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠 ANKI_HTML TEMPLATE 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠
-# 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠 ANKI_HTML TEMPLATE 🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠🧠
-# 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮 INTERACTIVE_HTML TEMPLATE 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮
-# 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮 INTERACTIVE_HTML TEMPLATE 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮
-# 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮 INTERACTIVE_HTML TEMPLATE 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮
-# 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮 INTERACTIVE_HTML TEMPLATE 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮
-# 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮 INTERACTIVE_HTML TEMPLATE 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮
-INTERACTIVE_HTML = """
-<!DOCTYPE html>
-<html>
-<head>
-  <meta charset="UTF-8">
-  <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1, user-scalable=no">
-  <title>Interactive Game</title>
-  <style>
-    /* Global resets and mobile-friendly properties */
-    * {
-      -webkit-tap-highlight-color: transparent;
-      user-select: none;
-    }
-    html {
-      touch-action: manipulation;
-    }
-    button {
-      -webkit-appearance: none;
-      outline: none;
-    }
-    body {
-      background-color: #121212;
-      color: #f0f0f0;
-      font-family: Arial, sans-serif;
-      text-align: center;
-      padding: 20px;
-    }
-    .container {
-      max-width: 800px;
-      margin: 0 auto;
-    }
-    /* Header with question progress on left and raw score on right */
-    .header {
-      display: flex;
-      justify-content: space-between;
-      align-items: center;
-      margin-bottom: 20px;
-    }
-    #questionProgress {
-      font-size: 20px;
-      text-align: left;
-    }
-    #rawScore {
-      font-size: 20px;
-      text-align: right;
-    }
-    .timer {
-      font-size: 24px;
-      margin-bottom: 20px;
-      /* <!-- ADDED CODE START (1/4) --> */
-      cursor: pointer; 
-      /* <!-- ADDED CODE END (1/4) --> */
-    }
-    .question-box {
-      background-color: #1e1e1e;
-      padding: 20px;
-      border: 2px solid #bb86fc;
-      border-radius: 10px;
-      margin-bottom: 20px;
-    }
-    .options {
-      list-style: none;
-      padding: 0;
-      display: flex;
-      flex-direction: column;
-      gap: 10px;
-      align-items: center;
-    }
-    .options li {
-      width: 100%;
-      max-width: 300px;
-    }
-    .option-button {
-      position: relative;
-      overflow: hidden;
-      border: none;
-      cursor: pointer;
-      background: linear-gradient(135deg, #3700b3, #6200ee);
-      color: #f0f0f0;
-      font-size: 18px;
-      width: 100%;
-      padding: 10px 20px;
-      border-radius: 10px;
-      transition: transform 0.3s ease, background 0.3s ease, box-shadow 0.3s ease;
-    }
-    @media (hover: hover) {
-      .option-button:hover {
-        transform: scale(1.05);
-      }
-    }
-    .option-button:active {
-      transform: scale(0.95);
-    }
-    .option-button.correct {
-      background: #03dac6 !important;
-      box-shadow: 0 0 10px #03dac6;
-      color: #fff !important;
-    }
-    .option-button.incorrect {
-      background: #cf6679 !important;
-      box-shadow: 0 0 10px #cf6679;
-      color: #fff !important;
-    }
-    .hidden {
-      display: none;
-    }
-    /* Ripple effect */
-    .ripple {
-      position: absolute;
-      border-radius: 50%;
-      background: rgba(255, 255, 255, 0.4);
-      transform: scale(0);
-      animation: ripple-animation 0.6s linear;
-      pointer-events: none;
-    }
-    @keyframes ripple-animation {
-      to {
-        transform: scale(4);
-        opacity: 0;
-      }
-    }
-    /* Loading Overlay Styles */
-    #loadingOverlay {
-      position: fixed;
-      top: 0;
-      left: 0;
-      width: 100%;
-      height: 100%;
-      background: #121212;
-      display: flex;
-      justify-content: center;
-      align-items: center;
-      z-index: 9999;
-    }
-  </style>
-  <script src="https://cdnjs.cloudflare.com/ajax/libs/bodymovin/5.7.6/lottie.min.js"></script>
-</head>
-<body>
-  <!-- Loading Overlay -->
-  <div id="loadingOverlay">
-    <div id="lottieContainer" style="width: 300px; height: 300px;"></div>
-  </div>
-  <div class="container" id="gameContainer" style="display: none;">
-    <div class="header">
-      <div id="questionProgress">Question 1 of 0</div>
-      <div id="rawScore">Score: 0</div>
-    </div>
-    <div class="timer" id="timer">Time: 15</div>
-    <div class="question-box" id="questionBox"></div>
-    <div id="optionsWrapper"></div>
-    <div id="feedback" class="hidden"></div>
-  </div>
-  <script src="https://cdn.jsdelivr.net/npm/canvas-confetti@1.5.1/dist/confetti.browser.min.js"></script>
-  <script>
-    // Initialize Lottie animation
-    var animation = lottie.loadAnimation({
-      container: document.getElementById('lottieContainer'),
-      renderer: 'svg',
-      loop: true,
-      autoplay: true,
-      path: 'https://lottie.host/embed/4500dbaf-9ac9-4b2b-b664-692cd9a3ccab/BGvTKQT8Tx.json'
-    });
-    // Once the page has fully loaded, hide the loading overlay and show the game container.
-    window.addEventListener('load', function() {
-      var overlay = document.getElementById('loadingOverlay');
-      var gameContainer = document.getElementById('gameContainer');
-      overlay.style.transition = 'opacity 0.5s ease';
-      overlay.style.opacity = '0';
-      setTimeout(function() {
-        overlay.style.display = 'none';
-        gameContainer.style.display = 'block';
-      }, 500);
-    });
-  </script>
-  <script>
-    const questions = {{ questions_json|safe }};
-    let currentQuestionIndex = 0;
-    let score = 0;
-    let timerInterval;
-    /* <!-- ADDED CODE START (2/4) --> */
-    let isTimingEnabled = true; // Timer is on by default
-    /* <!-- ADDED CODE END (2/4) --> */
-    const totalQuestions = questions.length;
-    const questionProgressEl = document.getElementById('questionProgress');
-    const rawScoreEl = document.getElementById('rawScore');
-    const timerEl = document.getElementById('timer');
-    const questionBox = document.getElementById('questionBox');
-    const optionsWrapper = document.getElementById('optionsWrapper');
-    const feedbackEl = document.getElementById('feedback');
-
-    /* <!-- ADDED CODE START (3/4) --> */
-    function toggleTimer() {
-        isTimingEnabled = !isTimingEnabled;
-        clearInterval(timerInterval); // Stop any active timer.
-
-        if (isTimingEnabled) {
-            // Re-enabling the timer. It will start fresh on the next question.
-            timerEl.textContent = 'Timer On';
-            timerEl.style.textDecoration = 'none';
-        } else {
-            // Disabling the timer.
-            timerEl.textContent = 'Timer Off';
-            timerEl.style.textDecoration = 'line-through';
-        }
-    }
-    /* <!-- ADDED CODE END (3/4) --> */
-
-    function startGame() {
-      score = 0;
-      currentQuestionIndex = 0;
-      updateHeader();
-      showQuestion();
-    }
-
-    function updateHeader() {
-      questionProgressEl.textContent = "Question " + (currentQuestionIndex+1) + " of " + totalQuestions;
-      rawScoreEl.textContent = "Score: " + score;
-    }
-
-    function startTimer(duration, callback) {
-      // If timing is off, update the display and do nothing else.
-      if (!isTimingEnabled) {
-        timerEl.textContent = "Timer Off";
-        timerEl.style.textDecoration = "line-through";
-        return; // Exit the function
-      }
+def compact_game_questions(questions):
+    """
+    Reduces questions to what the game page needs, with short keys and the
+    correct answer stored as an index into the options instead of a copy.
+    Questions whose answer is not among their options are dropped.
+    """
+    compact = []
+    for q in questions:
+        try:
+            correct_index = q["options"].index(q["correctAnswer"])
+        except ValueError:
+            logger.warning("Dropping question whose answer is not an option: %s", q["question"])
+            continue
+        compact.append({"q": q["question"], "o": q["options"], "c": correct_index})
+    return compact
+
+# Generated games, addressed by a random id. Kept on disk so any gunicorn
+# worker can serve /play/<gid> after the redirect, until they expire after
+# GAME_TTL seconds (a day by default).
+game_store = ResponseCache(
+    maxsize=256,
+    directory=os.path.join(os.environ.get("LLM_CACHE_DIR", DEFAULT_CACHE_DIR), "games"),
+    ttl=int(os.environ.get("GAME_TTL", str(24 * 3600))),
+)
 
-      // If timing is on, reset styles and start the timer.
-      timerEl.style.textDecoration = "none";
-      let timeRemaining = duration;
-      timerEl.textContent = "Time: " + timeRemaining;
-      timerInterval = setInterval(() => {
-        timeRemaining--;
-        timerEl.textContent = "Time: " + timeRemaining;
-        if (timeRemaining <= 0) {
-          clearInterval(timerInterval);
-          callback();
-        }
-      }, 1000);
-    }
+_QUESTIONS_URL_PLACEHOLDER = "__QUESTIONS_URL__"
 
-    function showQuestion() {
-      feedbackEl.classList.add('hidden');
-      if (currentQuestionIndex >= totalQuestions) {
-        endGame();
-        return;
-      }
-      const currentQuestion = questions[currentQuestionIndex];
-      questionBox.textContent = currentQuestion.question;
-      optionsWrapper.innerHTML = "";
-      const ul = document.createElement('ul');
-      ul.className = 'options';
-
-      const optionsShuffled = currentQuestion.options.slice();
-      for (let i = optionsShuffled.length - 1; i > 0; i--) {
-        const j = Math.floor(Math.random() * (i + 1));
-        [optionsShuffled[i], optionsShuffled[j]] = [optionsShuffled[j], optionsShuffled[i]];
-      }
-      optionsShuffled.forEach(option => {
-        const li = document.createElement('li');
-        const button = document.createElement('button');
-        button.textContent = option;
-        button.className = 'option-button';
-        button.onmousedown = function(e) { e.preventDefault(); };
-        button.setAttribute("ontouchend", "this.blur()");
-        button.onclick = () => selectAnswer(option);
-        button.addEventListener('click', function(e) {
-          const rect = button.getBoundingClientRect();
-          const ripple = document.createElement('span');
-          ripple.className = 'ripple';
-          ripple.style.left = (e.clientX - rect.left) + 'px';
-          ripple.style.top = (e.clientY - rect.top) + 'px';
-          button.appendChild(ripple);
-          setTimeout(() => {
-            ripple.remove();
-          }, 600);
-        });
-        li.appendChild(button);
-        ul.appendChild(li);
-      });
-      optionsWrapper.appendChild(ul);
-      startTimer(15, () => {
-        selectAnswer(null);
-      });
-      updateHeader();
-    }
-
-    function selectAnswer(selectedOption) {
-      clearInterval(timerInterval);
-      const currentQuestion = questions[currentQuestionIndex];
-      const buttons = document.querySelectorAll('.option-button');
-      const isCorrect = (selectedOption === currentQuestion.correctAnswer);
-      buttons.forEach(button => {
-        if (button.textContent === currentQuestion.correctAnswer) {
-          button.classList.add('correct');
-        } else if (button.textContent === selectedOption) {
-          button.classList.add('incorrect');
-        }
-        button.disabled = true;
-      });
-      if (isCorrect) {
-        score++;
-        confetti({
-          particleCount: 100,
-          spread: 70,
-          colors: ['#bb86fc', '#ffd700']
-        });
-      }
-      updateHeader();
-      setTimeout(() => {
-        currentQuestionIndex++;
-        showQuestion();
-      }, 2000);
-    }
+@functools.lru_cache(maxsize=None)
+def interactive_page_parts():
+    """
+    Renders the game page once around a placeholder and returns the encoded
+    bytes before and after it (the questions URL is the only dynamic part),
+    plus a short digest of them that changes whenever the template does.
+    """
+    page = app.jinja_env.get_template("interactive.html").render(questions_url=_QUESTIONS_URL_PLACEHOLDER)
+    head, tail = page.split(_dumps(_QUESTIONS_URL_PLACEHOLDER))
+    head, tail = head.encode("utf-8"), tail.encode("utf-8")
+    digest = hashlib.blake2b(head + tail, digest_size=8).hexdigest()
+    return head, tail, digest
 
-    function endGame() {
-      questionBox.textContent = "Game Over!";
-      optionsWrapper.innerHTML = "";
-      timerEl.textContent = "";
-      feedbackEl.classList.remove('hidden');
-      // Set up final results with Play Again, Show Anki Cards toggle, and Copy Anki Cards button.
-      feedbackEl.innerHTML = "<h2>Your final score is " + score + " out of " + totalQuestions + "</h2>" +
-        "<button onclick='startGame()' class='option-button' ontouchend='this.blur()'>Play Again</button>" +
-        "<button id='toggleAnkiBtn' class='option-button' ontouchend='this.blur()' style='margin-top:10px;'>Show Anki Cards</button>" +
-        "<div id='ankiCardsContainer' style='display:none; margin-top:10px; text-align:left; background-color:#1e1e1e; padding:10px; border:1px solid #bb86fc; border-radius:10px;'></div>" +
-        "<button id='copyAnkiBtn' class='option-button' ontouchend='this.blur()' style='display:none; margin-top:10px;'>Copy Anki Cards</button>" +
-        "<button id='downloadApkgBtn' class='option-button' ontouchend='this.blur()' style='margin-top:10px;'>Download APKG</button>";  // 🗑️ No removal needed here
-      // Add event listeners for the new buttons.
-      document.getElementById('toggleAnkiBtn').addEventListener('click', function(){
-        let container = document.getElementById('ankiCardsContainer');
-        let copyBtn = document.getElementById('copyAnkiBtn');
-        if (container.style.display === 'none') {
-           {% raw %}
-           let content = "";
-           questions.forEach(q => {
-               content += q.question + "<br><br>" + "{" + "{" + "c1::" + q.correctAnswer + "}" + "}" + "<br><br><br>";
-           });
-           {% endraw %}
-           container.innerHTML = content;
-           container.style.display = 'block';
-           copyBtn.style.display = 'block';
-           this.textContent = "Hide Anki Cards";
-        } else {
-           container.style.display = 'none';
-           copyBtn.style.display = 'none';
-           this.textContent = "Show Anki Cards";
-        }
-      });
-      document.getElementById('copyAnkiBtn').addEventListener('click', function(){
-         let container = document.getElementById('ankiCardsContainer');
-         let tempInput = document.createElement('textarea');
-         tempInput.value = container.innerText;
-         document.body.appendChild(tempInput);
-         tempInput.select();
-         document.execCommand('copy');
-         document.body.removeChild(tempInput);
-         this.textContent = "Copied!";
-         setTimeout(() => {
-             this.textContent = "Copy Anki Cards";
-         }, 2000);
-      });
-            // 🆕🛠️🚀 New Download APKG button listener
-      document.getElementById("downloadApkgBtn").addEventListener("click", function() {
-        // ✨ Assemble cloze‑formatted strings from questions
-        {% raw %}
-        const ankiCards = questions.map(q =>
-          `${q.question}<br><br>{{c1::${q.correctAnswer}}}`
-        );
-        {% endraw %}
-        fetch("/download_apkg", {
-          method: "POST",
-          headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({ saved_cards: ankiCards })
-        })
-        .then(res => {
-          if (!res.ok) throw new Error("Download failed");
-          return res.blob();
-        })
-        .then(blob => {
-          const url = URL.createObjectURL(blob);
-          const a   = document.createElement("a");
-          a.href    = url;
-          a.download = "game_cards.apkg";
-          document.body.appendChild(a);
-          a.click();
-          a.remove();
-          URL.revokeObjectURL(url);
-        })
-        .catch(err => {
-          console.error(err);
-          alert("Could not download APKG.");
-        });
-      });
-    }
+def cacheable_game_response(etag, body, mimetype):
+    """
+    Game content never changes for a gid, so the ETag only needs the gid
+    (plus the page version for the HTML shell).
+    """
+    response = Response(body, mimetype=mimetype)
+    response.cache_control.private = True
+    response.cache_control.max_age = 300
+    response.set_etag(etag)
+    return response.make_conditional(request)
 
-    /* <!-- ADDED CODE START (4/4) --> */
-    timerEl.addEventListener('click', toggleTimer);
-    /* <!-- ADDED CODE END (4/4) --> */
-
-    startGame();
-  </script>
-  <!-- Keep-alive ping -->
-  <script>
-    setInterval(() => fetch("/ping").catch(()=>{}), 2 * 60 * 1000);
-  </script>
-</body>
-</html>
-"""
-# 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮 INTERACTIVE_HTML TEMPLATE 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮
-# 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮 INTERACTIVE_HTML TEMPLATE 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮
-# 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮 INTERACTIVE_HTML TEMPLATE 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮
-# 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮 INTERACTIVE_HTML TEMPLATE 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮
-# 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮 INTERACTIVE_HTML TEMPLATE 🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮🎮
 # ----------------------------
 # Flask Routes
 # ----------------------------
@@ -2619,36 +1989,161 @@ def ping():
     return "", 200
 @app.route("/", methods=["GET"])
 def index():
-    return render_template_string(INDEX_HTML)
+    return render_template("index.html", suggested_semantic_threshold=DEFAULT_SEMANTIC_THRESHOLD)
 
 @app.route("/generate", methods=["POST"])
 def generate():
-    transcript = request.form.get("transcript")
+    # An uploaded .txt file takes precedence over the textarea. Werkzeug
+    # spools large uploads to disk, so the request body is read only once.
+    transcript_file = request.files.get("transcript_file")
+    if transcript_file and transcript_file.filename:
+        transcript = transcript_file.stream.read().decode("utf-8", "replace")
+    else:
+        transcript = request.form.get("transcript")
     if not transcript:
         return "Error: Please paste a transcript.", 400
     user_preferences = request.form.get("preferences", "")
-    model = request.form.get("model", "gpt-4o-mini")
+    model = request.form.get("model", DEFAULT_MODEL)
     max_size_str = request.form.get("max_size", "10000")
     try:
         max_size = int(max_size_str)
     except ValueError:
         max_size = 10000
+    max_tokens_str = request.form.get("max_tokens", "").strip()
+    if max_tokens_str:
+        try:
+            max_tokens = int(max_tokens_str)
+            if max_tokens < MIN_CHUNK_TOKENS:
+                raise ValueError("token budget below %d" % MIN_CHUNK_TOKENS)
+            max_size = chars_for_token_budget(transcript, max_tokens)
+        except ValueError as e:
+            logger.warning("Ignoring max_tokens %r: %s", max_tokens_str, e)
+        except Exception as e:
+            logger.error("Token-based chunk sizing failed, using characters: %s", e)
+    # chunk_text never advances on a non-positive size.
+    max_size = max(max_size, CHUNK_MIN_SIZE)
+
+    use_cache = request.form.get("no_cache") != "1"
+    # Semantic matching costs an embeddings call per chunk, so it is opt-in:
+    # an empty or invalid threshold leaves it off.
+    try:
+        semantic_threshold = float(request.form.get("semantic_threshold") or 0)
+    except ValueError:
+        semantic_threshold = 0
+    try:
+        max_workers = int(request.form.get("workers", MAX_CHUNK_WORKERS))
+    except ValueError:
+        max_workers = MAX_CHUNK_WORKERS
+    max_workers = max(1, min(max_workers, MAX_CHUNK_WORKERS_LIMIT))
 
     mode = request.form.get("mode", "Generate Anki Cards")
+    if mode != "Generate Game" and request.form.get("batch") == "1":
+        try:
+            batch = submit_anki_batch(transcript, user_preferences, max_chunk_size=max_size, model=model)
+        except Exception as e:
+            logger.error("Failed to submit batch: %s", e)
+            return "Failed to submit the batch job: " + str(e), 500
+        return redirect(url_for("batch_status", batch_id=batch.id))
     if mode == "Generate Game":
-        questions = get_all_interactive_questions(transcript, user_preferences, max_chunk_size=max_size, model=model)
-        logger.debug("Final interactive questions list: %s", questions)
+        questions = get_all_interactive_questions(
+            transcript, user_preferences, max_chunk_size=max_size, model=model,
+            use_cache=use_cache, semantic_threshold=semantic_threshold, max_workers=max_workers,
+        )
+        questions = compact_game_questions(questions)
+        logger.info("Final interactive questions list: %d questions", len(questions))
         if not questions:
             return "Failed to generate any interactive questions.", 500
-        questions_json = json.dumps(questions)
-        return render_template_string(INTERACTIVE_HTML, questions_json=questions_json)
+        # Post/redirect/get: the game lives at a stable URL, so reloads and
+        # back-navigation are served from the browser cache.
+        gid = uuid.uuid4().hex
+        game_store.set(make_cache_key("game", gid), questions)
+        return redirect(url_for("play", gid=gid), code=303)
     else:
-        cards = get_all_anki_cards(transcript, user_preferences, max_chunk_size=max_size, model=model)
-        logger.debug("Final flashcards list: %s", cards)
-        if not cards:
-            return "Failed to generate any Anki cards.", 500
-        cards_json = json.dumps(cards)
-        return render_template_string(ANKI_HTML, cards_json=cards_json)
+        # Stream the review page: the shell renders immediately and each card
+        # is appended by a small <script> as soon as the model finishes it.
+        errors = []
+        card_stream = iter_all_anki_cards(
+            transcript, user_preferences, max_chunk_size=max_size, model=model,
+            use_cache=use_cache, semantic_threshold=semantic_threshold, max_workers=max_workers,
+            errors=errors,
+        )
+        return stream_review_page(card_stream, errors)
+
+
+@app.route("/play/<gid>", methods=["GET"])
+def play(gid):
+    """Serves a generated game; its content never changes, so it is cacheable."""
+    if game_store.get(make_cache_key("game", gid)) is None:
+        return "This game has expired. Please generate it again.", 404
+    head, tail, page_digest = interactive_page_parts()
+    questions_url = _dumps(url_for("game_questions", gid=gid)).encode("utf-8")
+    # A deploy that changes the page must not be answered with a 304.
+    return cacheable_game_response(gid + "-" + page_digest, [head, questions_url, tail], "text/html")
+
+
+@app.route("/api/questions/<gid>", methods=["GET"])
+def game_questions(gid):
+    questions = game_store.get(make_cache_key("game", gid))
+    if questions is None:
+        return {"error": "This game has expired."}, 404
+    return cacheable_game_response(gid, orjson.dumps(questions, option=ORJSON_OPTIONS), "application/json")
+
+
+def stream_review_page(card_stream, card_errors=()):
+    """
+    Streams the Anki review page, appending each card as it is yielded.
+    `card_errors` is read after the stream is exhausted, so a list that the
+    stream fills in as it goes still reaches the page.
+    """
+    template = app.jinja_env.get_template("anki.html")
+    return Response(
+        stream_with_context(template.stream(card_stream=card_stream, card_errors=card_errors)),
+        mimetype="text/html",
+    )
+
+
+@app.route("/batch/<batch_id>", methods=["GET"])
+def batch_status(batch_id):
+    """
+    Shows the progress of a batch job, refreshing with a growing delay until
+    it finishes, then renders the review page from its results.
+    """
+    # A finished batch never changes, so its parsed cards are kept and later
+    # visits skip both the status call and the output download.
+    results_key = make_cache_key("batch", batch_id)
+    cards = chunk_cache.get(results_key)
+    if cards is not None:
+        return stream_review_page(iter(cards))
+    try:
+        batch = client.batches.retrieve(batch_id)
+    except Exception as e:
+        logger.error("Failed to retrieve batch %s: %s", batch_id, e)
+        return "Failed to look up the batch job: " + str(e), 404
+    if batch.status not in BATCH_FINAL_STATUSES:
+        try:
+            wait = int(request.args.get("wait", "5"))
+        except ValueError:
+            wait = 5
+        return render_template(
+            "batch.html",
+            batch=batch,
+            wait=wait,
+            next_url=url_for("batch_status", batch_id=batch_id, wait=min(wait * 2, 300)),
+        )
+    if batch.status != "completed":
+        return f"Batch job ended with status '{batch.status}'.", 500
+
+    cards = []
+    for i, result_text in enumerate(get_batch_results(batch)):
+        parsed = parse_anki_cards_response(result_text) if result_text else None
+        if parsed is None:
+            logger.error("No cards recovered for batch chunk %d", i)
+            continue
+        cards.extend(parsed)
+    if not cards:
+        return "Failed to generate any Anki cards.", 500
+    chunk_cache.set(results_key, cards)
+    return stream_review_page(iter(cards))
 
 
 @app.route("/make_brief", methods=["POST"])
@@ -2917,7 +2412,7 @@ def download_apkg():
                     return {"error": f"media item {index} is invalid"}, 400
                 filename = str(item.get("filename") or "").strip()
                 encoded = str(item.get("content_base64") or "")
-                if not filename or filename != os.path.basename(filename) or not re.fullmatch(r"[A-Za-z0-9._-]{1,180}", filename):
+                if not filename or filename != os.path.basename(filename) or not _MEDIA_FILENAME_RE.fullmatch(filename):
                     return {"error": f"media item {index} has an invalid filename"}, 400
                 try:
                     payload = base64.b64decode(encoded, validate=True)
@@ -2963,4 +2458,7 @@ def download_apkg():
 
 
 if __name__ == "__main__":
-    app.run(debug=True, port=10000)
+    # Local development only; production runs under gunicorn (see gunicorn.conf.py):
+    #   gunicorn app:app   (gthread workers, since requests wait on the OpenAI API)
+    # The reloader and interactive debugger are opt-in via FLASK_DEBUG=1.
+    app.run(debug=os.environ.get("FLASK_DEBUG") == "1", threaded=True, port=10000)
@@ -0,0 +1,15 @@
+"""
+Gunicorn settings, loaded automatically when gunicorn starts in this
+directory (e.g. `gunicorn app:app`).
+
+Requests spend most of their time waiting on the OpenAI API, so each worker
+serves several requests concurrently on threads instead of one at a time.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+# Generating cards for a long transcript can take several minutes.
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "300"))
@@ -0,0 +1,327 @@
+import base64
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+import numpy as np
+import orjson
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "yt2anki-llm-cache")
+DEFAULT_SEMANTIC_THRESHOLD = 0.95
+DEFAULT_SEMANTIC_MAX_ENTRIES = 2048
+DEFAULT_PRUNE_INTERVAL = 3600
+
+
+def make_cache_key(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Exact-match cache for parsed LLM results.
+
+    Entries live in an in-memory LRU and, when a directory is given, in one
+    JSON file per key so they survive restarts and are shared between
+    gunicorn workers. With a `ttl` (seconds), entries older than that are
+    treated as missing, and expired files are swept from the directory at
+    most once per `prune_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = DEFAULT_CACHE_SIZE,
+        directory: str | None = None,
+        ttl: float | None = None,
+        prune_interval: float = DEFAULT_PRUNE_INTERVAL,
+    ):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        # key -> (time stored, value)
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_prune = 0.0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def _remember(self, key: str, value: Any, stored_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (stored_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Any | None:
+        now = time.time()
+        with self._lock:
+            if key in self._entries:
+                stored_at, value = self._entries[key]
+                if not self._expired(stored_at, now):
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as handle:
+                stored_at = os.fstat(handle.fileno()).st_mtime
+                if self._expired(stored_at, now):
+                    return None
+                value = orjson.loads(handle.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as exc:
+            logger.warning("Ignoring unreadable cache entry %s: %s", key, exc)
+            return None
+        self._remember(key, value, stored_at)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        self._remember(key, value, now)
+        if not self.directory:
+            return
+        try:
+            # Write then rename so concurrent readers never see a partial file.
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as handle:
+                handle.write(orjson.dumps(value))
+            os.replace(tmp_path, self._path(key))
+        except OSError as exc:
+            logger.warning("Could not persist cache entry %s: %s", key, exc)
+        if self.ttl is not None and now >= self._next_prune:
+            self._next_prune = now + self.prune_interval
+            self.prune(now)
+
+    def prune(self, now: float | None = None) -> int:
+        """Deletes expired entry files (and stale temp files); returns how many."""
+        if not self.directory or self.ttl is None:
+            return 0
+        cutoff = (time.time() if now is None else now) - self.ttl
+        removed = 0
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if not entry.name.endswith((".json", ".tmp")) or not entry.is_file():
+                        continue
+                    try:
+                        if entry.stat().st_mtime < cutoff:
+                            os.remove(entry.path)
+                            removed += 1
+                    except FileNotFoundError:
+                        # Another worker pruned it first.
+                        pass
+        except OSError as exc:
+            logger.warning("Could not prune cache directory %s: %s", self.directory, exc)
+        if removed:
+            logger.info("Pruned %d expired cache entries from %s", removed, self.directory)
+        return removed
+
+
+class SemanticCache:
+    """Nearest-neighbour cache over chunk embeddings.
+
+    Vectors are stored L2-normalised per namespace (kind, model, preferences),
+    so a lookup is one matrix-vector product followed by an argmax. Each
+    namespace keeps at most `max_entries` vectors; when full, the older half
+    is dropped.
+
+    On disk every namespace is an append-only JSONL file of
+    {"e": base64 float32 vector, "v": value} lines. Adds append one line under
+    an exclusive file lock, and lookups first read whatever other processes
+    appended since, so gunicorn workers share entries without rewriting each
+    other's files. The file is compacted to the newest `max_entries` lines
+    once it holds about twice that many.
+    """
+
+    def __init__(self, directory: str | None = None, max_entries: int = DEFAULT_SEMANTIC_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._matrices: dict[str, np.ndarray] = {}
+        self._counts: dict[str, int] = {}
+        self._values: dict[str, list[Any]] = {}
+        # (inode, bytes read) of each namespace file this process has loaded.
+        self._positions: dict[str, tuple[int, int]] = {}
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, namespace: str) -> str:
+        return os.path.join(self.directory, namespace + ".jsonl")
+
+    def _reset(self, namespace: str) -> None:
+        self._matrices[namespace] = np.empty((0, 0), dtype=np.float32)
+        self._counts[namespace] = 0
+        self._values[namespace] = []
+
+    def _insert(self, namespace: str, row: np.ndarray, value: Any) -> None:
+        if namespace not in self._matrices:
+            self._reset(namespace)
+        count = self._counts[namespace]
+        matrix = self._matrices[namespace]
+        if matrix.shape[1] != row.shape[0]:
+            # First entry, or the embedding model changed: start over.
+            count = 0
+            matrix = np.empty((0, row.shape[0]), dtype=np.float32)
+            self._values[namespace] = []
+        if count == len(matrix):
+            if count >= self.max_entries:
+                keep = self.max_entries // 2
+                matrix[:keep] = matrix[count - keep:count]
+                del self._values[namespace][:count - keep]
+                count = keep
+            else:
+                grown = np.empty((min(self.max_entries, max(16, 2 * count)), row.shape[0]), dtype=np.float32)
+                grown[:count] = matrix[:count]
+                matrix = grown
+        matrix[count] = row
+        self._matrices[namespace] = matrix
+        self._counts[namespace] = count + 1
+        self._values[namespace].append(value)
+
+    def _refresh(self, namespace: str) -> None:
+        """Reads the lines appended to the namespace file since the last call."""
+        if not self.directory:
+            if namespace not in self._matrices:
+                self._reset(namespace)
+            return
+        path = self._path(namespace)
+        inode, offset = self._positions.get(namespace, (None, 0))
+        try:
+            with open(path, "rb") as handle:
+                stat = os.fstat(handle.fileno())
+                if stat.st_ino != inode:
+                    # New file, or compacted by another worker: reload it.
+                    self._reset(namespace)
+                    inode, offset = stat.st_ino, 0
+                if stat.st_size == offset:
+                    return
+                handle.seek(offset)
+                data = handle.read(stat.st_size - offset)
+        except FileNotFoundError:
+            if namespace not in self._matrices:
+                self._reset(namespace)
+            return
+        except OSError as exc:
+            logger.warning("Ignoring unreadable semantic cache %s: %s", namespace, exc)
+            if namespace not in self._matrices:
+                self._reset(namespace)
+            return
+        # A line still being appended is picked up on the next call.
+        complete = data.rfind(b"\n") + 1
+        for line in data[:complete].splitlines():
+            try:
+                entry = orjson.loads(line)
+                row = np.frombuffer(base64.b64decode(entry["e"]), dtype=np.float32)
+                value = entry["v"]
+            except (ValueError, KeyError, TypeError) as exc:
+                logger.warning("Skipping unreadable semantic cache entry in %s: %s", namespace, exc)
+                continue
+            self._insert(namespace, row, value)
+        self._positions[namespace] = (inode, offset + complete)
+
+    def _append(self, namespace: str, line: bytes) -> None:
+        path = self._path(namespace)
+        while True:
+            with open(path, "ab") as handle:
+                _lock_file(handle)
+                try:
+                    # A worker compacted the file while we waited for the
+                    # lock; append to the new one instead.
+                    if os.fstat(handle.fileno()).st_ino != os.stat(path).st_ino:
+                        continue
+                    handle.write(line)
+                    handle.flush()
+                    if handle.tell() > 2 * self.max_entries * len(line):
+                        self._compact(path)
+                    return
+                finally:
+                    _unlock_file(handle)
+
+    def _compact(self, path: str) -> None:
+        # Called with the file lock held, so no line is appended meanwhile.
+        with open(path, "rb") as handle:
+            lines = handle.read().splitlines(keepends=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as handle:
+            handle.writelines(lines[-self.max_entries:])
+        os.replace(tmp_path, path)
+
+    def lookup(self, namespace: str, embedding: np.ndarray, threshold: float) -> Any | None:
+        query = _normalize(embedding)
+        with self._lock:
+            self._refresh(namespace)
+            count = self._counts[namespace]
+            matrix = self._matrices[namespace]
+            if not count or matrix.shape[1] != query.shape[0]:
+                return None
+            sims = matrix[:count] @ query
+            best = int(np.argmax(sims))
+            if sims[best] < threshold:
+                return None
+            logger.debug("Semantic cache hit (similarity %.3f)", sims[best])
+            return self._values[namespace][best]
+
+    def add(self, namespace: str, embedding: np.ndarray, value: Any) -> None:
+        row = _normalize(embedding)
+        if not self.directory:
+            with self._lock:
+                self._refresh(namespace)
+                self._insert(namespace, row, value)
+            return
+        # Only the file lock is held while writing; the entry reaches memory
+        # through the next refresh, like entries from other workers.
+        line = orjson.dumps({"e": base64.b64encode(row.tobytes()).decode("ascii"), "v": value}) + b"\n"
+        try:
+            self._append(namespace, line)
+        except OSError as exc:
+            logger.warning("Could not persist semantic cache %s: %s", namespace, exc)
+            with self._lock:
+                self._refresh(namespace)
+                self._insert(namespace, row, value)
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+if fcntl is not None:
+    def _lock_file(handle) -> None:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_file(handle) -> None:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+else:
+    # No flock (Windows): a single dev-server process needs no file lock.
+    def _lock_file(handle) -> None:
+        pass
+
+    def _unlock_file(handle) -> None:
+        pass
@@ -1,10 +1,10 @@
-import json
 import logging
 import os
 import re
 from typing import Any
 from urllib.parse import parse_qs, urlparse
 
+import orjson
 import requests
 
 
@@ -17,6 +17,10 @@ GEMINI_API_URL_TEMPLATE = (
 )
 YOUTUBE_URL_PREVIEW_COST_DISPLAY = "[$0.00 preview]"
 
+_VIDEO_ID_RE = re.compile(r"[\w-]{11}")
+_FENCE_OPEN_RE = re.compile(r"^```(?:json)?\s*")
+_FENCE_CLOSE_RE = re.compile(r"\s*```$")
+
 QUIZ_RESPONSE_SCHEMA = {
     "type": "OBJECT",
     "properties": {
@@ -59,7 +63,7 @@ def extract_youtube_video_id(raw_url_or_id: str) -> str:
     if not candidate:
         raise YouTubeQuizError("Please enter a YouTube URL.", status_code=400)
 
-    if re.fullmatch(r"[\w-]{11}", candidate):
+    if _VIDEO_ID_RE.fullmatch(candidate):
         return candidate
 
     parsed = urlparse(candidate)
@@ -139,12 +143,12 @@ def _extract_json_text(api_response: dict[str, Any]) -> str:
 def _parse_quiz_json(raw_text: str) -> dict[str, Any]:
     cleaned = raw_text.strip()
     if cleaned.startswith("```"):
-        cleaned = re.sub(r"^```(?:json)?\s*", "", cleaned)
-        cleaned = re.sub(r"\s*```$", "", cleaned)
+        cleaned = _FENCE_OPEN_RE.sub("", cleaned)
+        cleaned = _FENCE_CLOSE_RE.sub("", cleaned)
 
     try:
-        return json.loads(cleaned)
-    except json.JSONDecodeError as exc:
+        return orjson.loads(cleaned)
+    except orjson.JSONDecodeError as exc:
         logger.error("Failed to parse Gemini JSON: %s", cleaned[:500])
         raise YouTubeQuizError(
             "Gemini returned malformed quiz JSON.",
@@ -251,7 +255,7 @@ def _post_gemini_request(request_payload: dict[str, Any]) -> dict[str, Any]:
         raise YouTubeQuizError(message, status_code=502)
 
     try:
-        return response.json()
+        return orjson.loads(response.content)
     except ValueError as exc:
         logger.error("Non-JSON Gemini response: %s", response_text[:1000])
         raise YouTubeQuizError(